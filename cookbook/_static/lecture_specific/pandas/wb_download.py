@@ -1,19 +1,13 @@
 import matplotlib.pyplot as plt
-import requests
-import pandas as pd
 
-# == Get data and read into file gd.xls == #
-wb_data_query = "http://api.worldbank.org/v2/en/indicator/gc.dod.totl.gd.zs?downloadformat=excel"
-r = requests.get(wb_data_query)
-with open('gd.xls', 'wb') as output:
-    output.write(r.content)
+from wb_indicators import load_indicators, to_wide
 
-# == Parse data into a DataFrame == #
-govt_debt = pd.read_excel('gd.xls', sheet_name='Data', skiprows=3, index_col=1)
+# == Get data, from the local cache if it is up to date == #
+indicator = "GC.DOD.TOTL.GD.ZS"
+data = load_indicators([indicator])
 
 # == Take desired values and plot == #
-govt_debt = govt_debt.transpose()
-govt_debt = govt_debt[['AUS', 'USA']]
-govt_debt = govt_debt[38:]
+govt_debt = to_wide(data, indicator, countries=['AUS', 'USA'])
+govt_debt = govt_debt.loc[1995:]
 govt_debt.plot(lw=2)
 plt.show()
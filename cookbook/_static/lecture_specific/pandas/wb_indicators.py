@@ -0,0 +1,168 @@
+"""
+Loading World Bank indicators, with a local cache.
+
+``wb_download.py`` downloads one indicator as an Excel file and parses it on
+every run. ``load_indicators`` instead:
+- downloads many indicators at the same time on a pool of threads, sharing
+  one ``requests`` session (so connections to the World Bank are reused);
+- keeps each indicator in a local Parquet file, which is much faster to read
+  than the Excel file, so later runs do not parse Excel at all;
+- uses the cached copy without asking the server if it is less than
+  ``max_age`` seconds old, and otherwise asks the server whether the data has
+  changed (using the ETag and Last-Modified headers), downloading it only if
+  it has; and
+- uses the cached copy, with a warning, if the server cannot be reached.
+"""
+
+import io
+import json
+import os
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+INDICATOR_URL = "http://api.worldbank.org/v2/en/indicator/{}?downloadformat=excel"
+DEFAULT_CACHE_DIR = "wb_cache"
+ONE_DAY = 24 * 60 * 60
+
+
+def make_session(pool_size=16, retries=3):
+    """A session with a connection pool, retrying failed requests with backoff."""
+    session = requests.Session()
+    retry = Retry(total=retries, backoff_factor=0.5,
+                  status_forcelist=(429, 500, 502, 503, 504))
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def parse_indicator(content):
+    """
+    Parses the World Bank Excel download into a long DataFrame with one row
+    per country and year.
+    """
+    # The same sheet and header rows as wb_download.py, read from memory
+    # rather than from a file on disk.
+    wide = pd.read_excel(io.BytesIO(content), sheet_name="Data", skiprows=3)
+    long = wide.melt(id_vars=["Country Name", "Country Code", "Indicator Name",
+                              "Indicator Code"],
+                     var_name="year", value_name="value")
+    long = long.dropna(subset=["value"])
+    return pd.DataFrame({
+        "indicator": long["Indicator Code"].astype("category"),
+        "country_code": long["Country Code"].astype("category"),
+        "country_name": long["Country Name"].astype("category"),
+        "year": pd.to_numeric(long["year"]).astype("int16"),
+        "value": long["value"].astype("float64"),
+    }).reset_index(drop=True)
+
+
+def _paths(cache_dir, indicator):
+    cache_dir = Path(cache_dir)
+    return cache_dir / f"{indicator}.parquet", cache_dir / f"{indicator}.json"
+
+
+def _write_atomic(path, write):
+    # Write to a temporary file and rename it, so that another process never
+    # reads a partly written file.
+    partial = path.with_name(path.name + ".partial")
+    write(partial)
+    os.replace(partial, path)
+
+
+def fetch_indicator(indicator, session=None, cache_dir=DEFAULT_CACHE_DIR, max_age=ONE_DAY,
+                    url_template=INDICATOR_URL, timeout=60):
+    """
+    Returns one indicator (e.g. "GC.DOD.TOTL.GD.ZS", central government debt
+    as a % of GDP) as a long DataFrame, from the cache if possible.
+
+    Returns the DataFrame and where it came from: "cache" (fresh enough to
+    use without asking the server), "not modified" (the server confirmed the
+    cached copy is current), "downloaded", or "stale cache" (the server could
+    not be reached).
+    """
+    session = session or make_session()
+    data_path, meta_path = _paths(cache_dir, indicator)
+    meta = json.loads(meta_path.read_text()) if meta_path.exists() else None
+    if meta is not None and not data_path.exists():
+        meta = None
+
+    if meta is not None and time.time() - meta["fetched_at"] < max_age:
+        return pd.read_parquet(data_path), "cache"
+
+    headers = {}
+    if meta is not None:
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+    try:
+        response = session.get(url_template.format(indicator), headers=headers, timeout=timeout)
+        response.raise_for_status()
+    except requests.RequestException as e:
+        if meta is None:
+            raise
+        warnings.warn(f"Could not fetch {indicator} ({e}), using the cached copy "
+                      f"from {time.ctime(meta['fetched_at'])}")
+        return pd.read_parquet(data_path), "stale cache"
+
+    if response.status_code == 304:
+        source = "not modified"
+        data = pd.read_parquet(data_path)
+    else:
+        source = "downloaded"
+        data = parse_indicator(response.content)
+        Path(cache_dir).mkdir(parents=True, exist_ok=True)
+        _write_atomic(data_path, lambda path: data.to_parquet(path, index=False))
+        meta = {"indicator": indicator}
+    meta.update({"fetched_at": time.time(),
+                 "etag": response.headers.get("ETag", meta.get("etag")),
+                 "last_modified": response.headers.get("Last-Modified",
+                                                       meta.get("last_modified"))})
+    _write_atomic(meta_path, lambda path: path.write_text(json.dumps(meta)))
+    return data, source
+
+
+def load_indicators(indicators, cache_dir=DEFAULT_CACHE_DIR, max_age=ONE_DAY, max_workers=8,
+                    session=None, url_template=INDICATOR_URL):
+    """
+    Loads several indicators at once, fetching them on max_workers threads.
+
+    Returns one long DataFrame with columns indicator, country_code,
+    country_name, year and value. Use ``to_wide`` for a table of years by
+    country, as in wb_download.py.
+    """
+    # A list, so that the indicators can be gone through again when printing
+    # where each came from (e.g. if a generator is passed).
+    indicators = list(indicators)
+    session = session or make_session(pool_size=max_workers)
+
+    def fetch(indicator):
+        return fetch_indicator(indicator, session, cache_dir, max_age, url_template)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(fetch, indicators))
+    for indicator, (_, source) in zip(indicators, results):
+        print(f"{indicator}: {source}")
+    data = pd.concat([data for data, _ in results], ignore_index=True)
+    return data.astype({"indicator": "category", "country_code": "category",
+                        "country_name": "category"})
+
+
+def to_wide(data, indicator=None, countries=None):
+    """A table of one indicator with a row per year and a column per country."""
+    if indicator is not None:
+        data = data[data["indicator"] == indicator]
+    wide = data.pivot_table(index="year", columns="country_code", values="value",
+                            observed=True)
+    if countries is not None:
+        wide = wide[countries]
+    return wide
@@ -49,11 +49,27 @@ import numpy as np
 # Packages to be used in pre-processing the text.
 import re
 import nltk
-nltk.download('stopwords') # For a standard list of stopwords.
-nltk.download('wordnet') # For lemmatisation.
-import pkg_resources
 !pip install symspellpy
-from symspellpy import SymSpell, Verbosity
+from symspellpy import Verbosity
+
+# Helper functions for running the cleaning on larger corpora.
+# These are saved in the 'sentiment_pipeline' folder next to this notebook.
+from sentiment_pipeline import SpellingTable, build_vocabulary, clean_column
+from sentiment_pipeline import ensure_nltk_data, load_sym_spell
+from sentiment_pipeline import read_tfidf, stream_reviews
+from sentiment_pipeline import EmbeddingStore
+from sentiment_pipeline import benchmark_reduction, embed_2d, reduce_dimensions
+from sentiment_pipeline import fit_clusters, sweep_k
+from sentiment_pipeline import cluster_term_frequencies, plot_wordcloud, top_terms
+from sentiment_pipeline import RunProfiler, check_import_time, load_history
+
+# Download the nltk stopwords (for a standard list of stopwords) and wordnet
+# (for lemmatisation), if they are not already installed.
+ensure_nltk_data()
+
+# Record the time and memory used by each of the main steps of the notebook.
+# A summary is shown in the appendix at the end of the notebook.
+profiler = RunProfiler('DAA_M07_CS2')
 
 # Packages for visualisation.
 # from pprint import pprint
@@ -85,7 +101,7 @@ from sklearn.metrics import silhouette_score
 # %% id="YmACh9GvuloJ"
 # Define a function to clean text.
 # Note that not all of these cleaning steps may be needed for different models.
-def clean_text(text, full_clean=1):
+def clean_text(text, full_clean=1, spelling_table=None):
     ''' Basic cleaning does the following:
         - converts all words to lowercase;
         - removes punctuation and special characters;
@@ -96,6 +112,9 @@ def clean_text(text, full_clean=1):
         - removes stop words;
         - performs stemming; and
         - performs lemmatisation.
+
+        If a spelling_table is given, spelling corrections are taken from the
+        table rather than looked up in SymSpell for every word.
     '''
 
     # Convert all text to lower case.
@@ -111,25 +130,26 @@ def clean_text(text, full_clean=1):
     # Fix spelling mistakes.
     # The sym_spell.lookup function highlights words that are not in the
     # symspell dictionary and offers suggested alternatives for these words.
-    text_list_spell = []
-    for word in text_list:
-        suggestions = sym_spell.lookup(word, Verbosity.CLOSEST, max_edit_distance=3)
-        if suggestions:
-            text_list_spell.append(suggestions[0].term)
-        else:
-            pass
-    text_list = text_list_spell[:]
+    if spelling_table is not None:
+        text_list = spelling_table.correct(text_list)
+    else:
+        text_list_spell = []
+        for word in text_list:
+            suggestions = sym_spell.lookup(word, Verbosity.CLOSEST, max_edit_distance=3)
+            if suggestions:
+                text_list_spell.append(suggestions[0].term)
+            else:
+                pass
+        text_list = text_list_spell[:]
 
     if full_clean==1:
         # Remove stopwords.
         text_list = [word for word in text_list if word not in stopwords]
 
         # Perform stemming.
-        ps = nltk.stem.porter.PorterStemmer()
         text_list = [ps.stem(word) for word in text_list]
 
         # Perform lemmatisation.
-        wnl = nltk.stem.wordnet.WordNetLemmatizer()
         text_list = [wnl.lemmatize(word) for word in text_list]
 
     result = ' '.join(text_list)
@@ -176,14 +196,22 @@ print(dataset.shape)
 
 # %% colab={"base_uri": "https://localhost:8080/"} id="TQ74oyZehLXU" outputId="45762004-2554-43b5-83b2-148731e35c58"
 # Get spelling datasets.
-sym_spell = SymSpell(max_dictionary_edit_distance=3, prefix_length=7)
-dictionary_path = pkg_resources.resource_filename('symspellpy', 'frequency_dictionary_en_82_765.txt')
-sym_spell.load_dictionary(dictionary_path, term_index=0, count_index=1)
-
-# Add some common words to the dictionary that are likely to be found in the
-# case study corpus, to avoid them being incorrectly 'fixed' by the spell checker.
-sym_spell.create_dictionary_entry('covid', 5)
-sym_spell.create_dictionary_entry('coronavirus', 5)
+# load_sym_spell loads the symspell English dictionary, with a maximum edit
+# distance of 3 and a prefix length of 7, and adds some common words that are
+# likely to be found in the case study corpus ('covid' and 'coronavirus'), to
+# avoid them being incorrectly 'fixed' by the spell checker.
+# Building the dictionary takes several seconds, so the first time this is run
+# it is saved to the folder below, and later runs load it from there in a
+# fraction of a second.
+sym_spell_index = 'DAA_M07_CS2_symspell_index'
+sym_spell = load_sym_spell(max_edit_distance=3, prefix_length=7, index_dir=sym_spell_index)
+
+# Most words appear in many reviews, so rather than correcting each word every
+# time it appears, each distinct word is corrected once and saved in a lookup
+# table. The table is saved to disk, so re-running the notebook only needs to
+# correct words that have not been seen before.
+spelling_table_path = 'DAA_M07_CS2_spelling_table.json'
+spelling_table = SpellingTable.load(spelling_table_path, sym_spell, max_edit_distance=3)
 
 # %% [markdown] id="4qC9iRUytyeN"
 # ### Explore data (EDA)
@@ -219,6 +247,10 @@ dataset['body'][0]
 # Get stopwords.
 stopwords = nltk.corpus.stopwords.words('english')
 
+# Create the stemmer and lemmatiser once, rather than every time clean_text is called.
+ps = nltk.stem.porter.PorterStemmer()
+wnl = nltk.stem.wordnet.WordNetLemmatizer()
+
 # %% colab={"base_uri": "https://localhost:8080/"} id="nexbwJcJhLXs" outputId="4d688fb0-724a-41a9-ff53-fbeee42b6a71"
 # Check that the cleaning function defined at the top of the notebook
 # is working as expected.
@@ -244,13 +276,27 @@ print(clean_text(dataset['body'][review_number-1], full_clean=1))
 # You should look at the cleaning output for a few different reviews to find other examples of changes that have been made by the cleaning function. Are you happy with all of these changes?
 
 # %% colab={"base_uri": "https://localhost:8080/", "height": 293} id="NgKAP1_ThLXt" outputId="b28f6f88-2556-4566-8037-2a187df64827"
-# Run the cleaning function on the full dataset. This step can take a while to run.
-dataset['body_clean_full'] = dataset['body'].apply(lambda x: clean_text(x, full_clean=1))
-    # The lambda function is used above to apply the clean_text function to all the
-    # reviews in the corpus.
-dataset['body_clean_bert'] = dataset['body'].apply(lambda x: clean_text(x, full_clean=0))
+# Correct the spelling of each distinct word in the corpus once.
+profiler.start('spelling table', n_items=len(dataset))
+spelling_table.update(build_vocabulary(dataset['body']))
+spelling_table.save(spelling_table_path)
+profiler.stop()
+
+# Run the cleaning on the full dataset. This step can take a while to run.
+# clean_column does the same cleaning as clean_text, but splits the reviews
+# into chunks that are cleaned in parallel on all of the available cores,
+# and returns both the full and basic clean in one pass over the reviews.
+# This is the same as running:
+#   dataset['body'].apply(lambda x: clean_text(x, full_clean=1, spelling_table=spelling_table))
+#   dataset['body'].apply(lambda x: clean_text(x, full_clean=0, spelling_table=spelling_table))
+profiler.start('cleaning', n_items=len(dataset))
+body_clean_full, body_clean_bert = clean_column(
+    dataset['body'], spelling_table_path=spelling_table_path, sym_spell_index=sym_spell_index)
+dataset['body_clean_full'] = body_clean_full
+dataset['body_clean_bert'] = body_clean_bert
     # The 'body_clean_bert' uses a basic clean to prepare the data for use with the
     # Bert model.
+profiler.stop()
 dataset.head()
 
 # %% [markdown] id="19TTnnckqK-u"
@@ -291,23 +337,35 @@ ratings = [1,2]
 # %% [markdown] id="m0oRRWoQhLXw"
 # ##### TF-IDF
 #
-# In this approach, TF-IDF is used to get the statistical weights of the tokens in each review. These weights are then reduced to two dimensions using t-SNE (t-SNE is an alternative dimension reduction technique to PCA). This makes it easier to visualise the different clusters that are found using K-Means clustering (see the Modelling section of the notebook).
+# In this approach, TF-IDF is used to get the statistical weights of the tokens in each review. These weights are reduced to 50 dimensions using TruncatedSVD (a version of PCA that works directly on the sparse TF-IDF matrix), and the reviews are clustered on these 50-dimensional vectors using K-Means clustering (see the Modelling section of the notebook).
+#
+# The 50-dimensional vectors are then reduced to two dimensions using t-SNE (t-SNE is an alternative dimension reduction technique to PCA). This is only used to visualise the clusters: t-SNE keeps reviews that are close together in the 50 dimensions close together in the plot, but most of the information in the vectors is lost, so the clustering is not done on the t-SNE output. Running t-SNE on 50 dimensions rather than on the full TF-IDF weights is also much faster.
 
 # %% colab={"base_uri": "https://localhost:8080/"} id="hYghYBfLhLXx" outputId="dd963dc7-dc76-48f5-e221-32af9e6c3056"
 # Generate TF-IDF weights
 clean_input = dataset['body_clean_full'].tolist()
+profiler.start('tf-idf', n_items=len(clean_input))
 tfidf = TfidfVectorizer()
 embedding_tfidf = tfidf.fit_transform(clean_input)
+profiler.stop()
 print('Shape of list containing reviews and their tf-idf weights:', embedding_tfidf.shape)
 
+profiler.start('SVD (tf-idf)', n_items=embedding_tfidf.shape[0])
+embedding_tfidf_svd = reduce_dimensions(embedding_tfidf, n_components=50)
+profiler.stop()
+print('Shape of list containing reviews and their SVD components:', embedding_tfidf_svd.shape)
+
+# t-SNE is only used to plot the clusters.
+profiler.start('t-SNE (tf-idf)', n_items=embedding_tfidf_svd.shape[0])
 tsne1 = TSNE(n_components=2)
-embedding_tfidf_tsne = tsne1.fit_transform(embedding_tfidf)
+embedding_tfidf_tsne = tsne1.fit_transform(embedding_tfidf_svd)
+profiler.stop()
 print('Shape of list containing reviews and their t-SNE components:', embedding_tfidf_tsne.shape)
 
 # %% [markdown] id="SWJRP2_mhLX1"
 # ##### BERT
 #
-# This approach uses BERT to get the encodings for each review. These weights are then again reduced to two dimensions using t-SNE to make it easier to visualise the different clusters that are found using K-Means clustering.
+# This approach uses BERT to get the encodings for each review. These are reduced to 50 dimensions using PCA for the K-Means clustering, and again to two dimensions using t-SNE to visualise the clusters.
 #
 #
 # Import the BERT data set (the text that has only had basic cleaning).
@@ -326,21 +384,35 @@ model = SentenceTransformer('distilbert-base-nli-mean-tokens')
 # Perform the embeddings.
 # Note that the first time this is run, the BERT model will download.
 # This can take some time as the model is approximately 265Mb.
+#
+# The embeddings are saved to disk in an ``EmbeddingStore``, so that when the notebook is run again only reviews that are new (or whose cleaned text has changed) are encoded. The reviews are encoded in batches of similar length, which reduces the time spent on padding shorter reviews.
 
 # %% id="SWJRP2_mhLX1"
-embeddings = model.encode(bert_input, show_progress_bar=False)
+embedding_store = EmbeddingStore('DAA_M07_CS2_embeddings', 'distilbert-base-nli-mean-tokens',
+                                  model=model)
+profiler.start('BERT encoding', n_items=len(bert_input))
+embeddings = embedding_store.encode(bert_input, batch_size=64)
 embedding_BERT = np.array(embeddings)
+profiler.stop()
 
 print('Getting vector embeddings for BERT. Done!')
 
 print('Shape of list containing reviews and their BERT weights:', embeddings.shape)
 
 # %% [markdown] id="SWJRP2_mhLX1"
-# Again, t-SNE is applied to reduce the dimension of the BERT embeddings.
+# Again, PCA is applied to reduce the dimension of the BERT embeddings for the clustering, and t-SNE to plot the clusters.
 
 # %% id="SWJRP2_mhLX1"
+profiler.start('PCA (BERT)', n_items=len(embedding_BERT))
+embedding_BERT_pca = reduce_dimensions(embedding_BERT, n_components=50)
+profiler.stop()
+print('Shape of list containing reviews and their principal components:',
+      embedding_BERT_pca.shape)
+
+profiler.start('t-SNE (BERT)', n_items=len(embedding_BERT_pca))
 tsne2 = TSNE(n_components=2)
-embedding_BERT_tsne = tsne2.fit_transform(embedding_BERT)
+embedding_BERT_tsne = tsne2.fit_transform(embedding_BERT_pca)
+profiler.stop()
 print('Shape of list containing reviews and their t-SNE components:',
       embedding_BERT_tsne.shape)
 
@@ -360,22 +432,25 @@ print('Bert embedding sample', embeddings[0][0:50])
 # %% colab={"base_uri": "https://localhost:8080/"} id="xsfU8fORF5rl" outputId="029b85ee-719e-4944-f812-01a907634cfb"
 # Use the TF-IDF approach to cluster the reviews into K topics.
 K = 6
+profiler.start('KMeans (tf-idf)', n_items=len(embedding_tfidf_svd))
 kmeans_model1 = KMeans(K)
-score_tfidf_tsne = kmeans_model1.fit(embedding_tfidf_tsne).score(embedding_tfidf_tsne)
-    # This step fits the kmeans model and calculates a cluster score (WCSS)
-    # for the model. WCSS measures the (negative) sum of squared distances
-    # of observations to their closest cluster centroid, so a smaller score
-    # indicates a better clustering of the data.
-labels_tfidf_kmeans = kmeans_model1.predict(embedding_tfidf_tsne)
+score_tfidf = kmeans_model1.fit(embedding_tfidf_svd).score(embedding_tfidf_svd)
+    # This step fits the kmeans model to the SVD components and calculates a
+    # cluster score (WCSS) for the model. WCSS measures the (negative) sum of
+    # squared distances of observations to their closest cluster centroid, so
+    # a smaller score indicates a better clustering of the data.
+labels_tfidf_kmeans = kmeans_model1.predict(embedding_tfidf_svd)
 dataset['label_TFIDF_KMeans'] = list(labels_tfidf_kmeans)
-print(score_tfidf_tsne)
+profiler.stop()
+print(score_tfidf)
 
 # %% colab={"base_uri": "https://localhost:8080/", "height": 1000} id="RL4By8czhLXy" outputId="70deae02-399a-47a9-cae2-78617ae54a26"
 # Create a set of distinct labels from the clustering.
 labels1 = np.array(labels_tfidf_kmeans)
 distinct_labels1 =  set(labels_tfidf_kmeans)
 
-# Create a plot of the reviews clustered by 'topic'.
+# Create a plot of the reviews clustered by 'topic', using the t-SNE
+# components to place each review.
 # Note that at this point the 'topic' of each cluster has not yet
 # been analysed or defined.
 n = len(labels_tfidf_kmeans)
@@ -387,7 +462,7 @@ for i in range(len(distinct_labels1)):
     y = embedding_tfidf_tsne[:, 1][labels1 == i]
     plt.plot(x, y, '.', alpha=0.4, label= cluster_label)
 plt.legend(title='Topic',loc = 'upper left', bbox_to_anchor=(1.01,1))
-plt.title('{} topics identified with tf-idf, t-SNE and KMeans'.format(K))
+plt.title('{} topics identified with tf-idf, SVD and KMeans'.format(K))
 
 # Create a list of context specific common words that will
 # be hidden in the word clouds produced.
@@ -395,30 +470,34 @@ hidden_words = ['insurance','travel','policy','claim']
 
 # Create a word cloud to help identify the meaning of
 # each 'topic' identified in the KMeans clustering.
+profiler.start('word clouds (tf-idf)', n_items=K)
 for each in range(0,K):
     get_wordcloud(each,'label_TFIDF_KMeans',hidden_words)
+profiler.stop()
 
 
 # %% [markdown] id="PZ9m9ImsU1iF"
 # ### Using BERT vectorisation
 
 # %% colab={"base_uri": "https://localhost:8080/"} id="FiMi5anKhLX4" outputId="6f2bf401-099d-4806-a9bd-d6a4b861c681"
-# Apply K-Means clustering to the BERT vectors.
+# Apply K-Means clustering to the principal components of the BERT vectors.
 K2 = 6
+profiler.start('KMeans (BERT)', n_items=len(embedding_BERT_pca))
 kmeans_model2 = KMeans(K2)
-score_BERT_tsne = kmeans_model2.fit(embedding_BERT_tsne).score(embedding_BERT_tsne)
-labels_BERT_kmeans = kmeans_model2.predict(embedding_BERT_tsne)
+score_BERT = kmeans_model2.fit(embedding_BERT_pca).score(embedding_BERT_pca)
+labels_BERT_kmeans = kmeans_model2.predict(embedding_BERT_pca)
 dataset['label_BERT_KMeans'] = list(labels_BERT_kmeans)
-print(score_BERT_tsne)
+profiler.stop()
+print(score_BERT)
 
 # %% colab={"base_uri": "https://localhost:8080/", "height": 1000} id="b7dVxc-eZNzj" outputId="74720684-988a-4fcd-89d5-c29109cba412"
 # Create a set of distinct labels from the clustering.
 labels2 = np.array(labels_BERT_kmeans)
 distinct_labels2 =  set(labels_BERT_kmeans)
 
-# Create a plot of the reviews clustered by 'topic'
-# where the 'topic' of each cluster has not yet
-# been analysed.
+# Create a plot of the reviews clustered by 'topic', using the t-SNE
+# components to place each review, where the 'topic' of each cluster
+# has not yet been analysed.
 n = len(embedding_BERT_tsne)
 counter = Counter(labels2)
 for i in range(len(distinct_labels2)):
@@ -428,7 +507,7 @@ for i in range(len(distinct_labels2)):
     y = embedding_BERT_tsne[:, 1][labels2 == i]
     plt.plot(x, y, '.', alpha=0.4, label= cluster_label)
 plt.legend(title='Topic',loc = 'upper left', bbox_to_anchor=(1.01,1))
-plt.title('{} topics identified with BERT, tf-idf and t-SNE'.format(K2))
+plt.title('{} topics identified with BERT, PCA and KMeans'.format(K2))
 
 # Create a list of context specific common words that will
 # be hidden in the word clouds producted.
@@ -436,8 +515,10 @@ hidden_words2 = ['insurance','travel','policy','claim']
 
 # Create a word cloud to help identify the meaning of
 # each 'topic' identified in the KMeans clustering.
+profiler.start('word clouds (BERT)', n_items=K2)
 for each in range(0,K2):
     get_wordcloud(each,'label_BERT_KMeans',hidden_words2)
+profiler.stop()
 
 # %% [markdown] id="bDt1DBATWJ_3"
 # ## Evaluate
@@ -448,29 +529,135 @@ for each in range(0,K2):
 # The best silhouette value is 1 and the worst value is -1. Values near 0 indicate overlapping clusters. Negative values generally indicate that an observation has been assigned to the wrong cluster, as a different cluster is more similar.
 
 # %% colab={"base_uri": "https://localhost:8080/"} id="YvZz_a-DhLX5" outputId="df75bfdf-cec6-4639-e361-6537f5e1108a"
-# Calculate the silhouette value for the TF-IDF based clustering after t-SNE
-# has been applied to reduce the dimension of the embeddings.
-print('Silhouette Score (TF-IDF and t-SNE):',
-      silhouette_score(embedding_tfidf_tsne , labels_tfidf_kmeans))
-
-# Calculate silhouette values for the BERT based clustering.
-#print('Silhouette Score (BERT):',
-#      silhouette_score(embedding_BERT , labels_BERT_kmeans))
-
-# Calculate the silhouette value for the BERT based clustering after t-SNE
-# has been applied to reduce the dimension of the embeddings.
-print('Silhouette Score (BERT and t-SNE):',
-      silhouette_score(embedding_BERT_tsne , labels_BERT_kmeans))
+# Calculate the silhouette value for the TF-IDF based clustering, on the
+# SVD components that the clusters were fitted to.
+profiler.start('silhouette scores', n_items=2 * len(labels_tfidf_kmeans))
+print('Silhouette Score (TF-IDF and SVD):',
+      silhouette_score(embedding_tfidf_svd, labels_tfidf_kmeans))
+
+# Calculate the silhouette value for the BERT based clustering, on the
+# principal components that the clusters were fitted to.
+print('Silhouette Score (BERT and PCA):',
+      silhouette_score(embedding_BERT_pca, labels_BERT_kmeans))
+profiler.stop()
 
 # The WCSS scores for the TF-IDF and BERT models are also shown:
-print('WCSS Score (TF-IDF and t-SNE):', score_tfidf_tsne)
-print('WCSS Score (BERT):', score_BERT_tsne)
+print('WCSS Score (TF-IDF and SVD):', score_tfidf)
+print('WCSS Score (BERT and PCA):', score_BERT)
 
 # %% [markdown] id="rcGglcOCcU5C"
-# The output above suggests that the embeddings using BERT produced marginally better clustering outcomes, with a slightly higher silhouette value and WCSS score.
+# A higher silhouette value indicates clusters that are more clearly separated, so the approach with the higher value above has produced the better clustering. The WCSS scores are not comparable between the two approaches, as they are measured on different vectors (the SVD components of the TF-IDF weights and the principal components of the BERT embeddings), but they can be used to compare different numbers of clusters K for the same approach (see ``sweep_k`` in the appendix).
 
 # %% [markdown] id="LKZDsrkUc1KY"
 # # Commentary
 # The 'Monitor results' section of Case Study 2 in Module 6 of the DAA course contained a discussion of how the analysis such as that conducted above can be used to interpret key areas or themes of feedback from travel insurance customers.
 #
 # The reader can play around with analysing different subsets of the reviews in this case study, to see what themes emerge for reviews with high and low ratings, and for reviews over different time periods.
+
+# %% [markdown]
+# # Appendix: Analysing larger datasets
+# The steps above hold all of the reviews, and two cleaned copies of them, in memory at once. This works well for the 19,395 reviews in this case study, but not for datasets of millions of reviews. This appendix shows how the same steps can be run on larger datasets using the helper functions in the ``sentiment_pipeline`` folder.
+#
+# #### Streaming the reviews
+# ``stream_reviews`` reads the zipped csv file in chunks of rows. Each chunk is cleaned, its term counts are calculated with a ``HashingVectorizer`` (which, unlike ``TfidfVectorizer``, does not need to see all of the reviews before it can be used) and the results are saved to disk in the Parquet format. Only one chunk is held in memory at a time.
+
+# %%
+reviews_dir = 'DAA_M07_CS2_reviews'
+summary = stream_reviews(
+    'https://actuariesinstitute.github.io/cookbook/_static/daa_datasets/DAA_M07_CS2_data.csv.zip',
+    reviews_dir, chunksize=5000, spelling_table_path=spelling_table_path,
+    sym_spell_index=sym_spell_index)
+print(summary)
+
+# The TF-IDF weights can then be read back one chunk at a time.
+embedding_tfidf_chunk = next(read_tfidf(reviews_dir))
+print('Shape of the TF-IDF weights for the first chunk:', embedding_tfidf_chunk.shape)
+
+# %% [markdown]
+# #### Plotting the clusters
+# The clustering above is done on the 50-dimensional SVD and PCA vectors, which scales well to large datasets. The t-SNE plots do not: the exact t-SNE in scikit-learn becomes very slow for more than a few tens of thousands of reviews.
+#
+# For larger datasets, ``embed_2d`` calculates the two-dimensional embedding for the plot on a sample of the reviews using UMAP, which uses approximate nearest neighbours and is much faster than t-SNE. UMAP can be installed with ``pip install umap-learn``.
+
+# %%
+# Plot a sample of 10,000 reviews, coloured by the clusters found above.
+rows, embedding_tfidf_2d = embed_2d(embedding_tfidf_svd, method='umap', sample_size=10000)
+for i in range(K):
+    in_cluster = labels_tfidf_kmeans[rows] == i
+    plt.plot(embedding_tfidf_2d[in_cluster, 0], embedding_tfidf_2d[in_cluster, 1],
+             '.', alpha=0.4, label=f'cluster {i+1}')
+plt.legend(title='Topic', loc='upper left', bbox_to_anchor=(1.01, 1))
+plt.title('{} topics identified with tf-idf, SVD and KMeans'.format(K))
+
+# %% [markdown]
+# The time and memory used by this approach and the earlier version of this notebook, which ran t-SNE on the full TF-IDF weights and clustered its two-dimensional output, can be compared using ``benchmark_reduction``, which runs both on randomly generated TF-IDF weights for 10,000, 100,000 and 1,000,000 reviews. The t-SNE approach is only run up to 100,000 reviews.
+
+# %%
+# The benchmark takes a long time to run. If you want to run it, then remove
+# the '#' at the start of the line below:
+
+# benchmark_reduction(sizes=(10000, 100000, 1000000))
+
+# %% [markdown]
+# #### Choosing the number of clusters
+# The number of clusters K was set to 6 above. ``sweep_k`` fits a mini-batch KMeans model for a range of values of K, in parallel, using the reduced embeddings. For each K it reports the WCSS, a silhouette score estimated from a sample of 10,000 reviews (calculating the silhouette score on all of the reviews takes time and memory that grow with the square of the number of reviews) and the Calinski-Harabasz score (larger is better).
+
+# %%
+sweep_tfidf = sweep_k(embedding_tfidf_svd, k_values=range(2, 13))
+print(sweep_tfidf)
+
+# Fit the final model with the chosen number of clusters.
+K3 = 6
+labels_tfidf_minibatch = fit_clusters(embedding_tfidf_svd, K3).labels_
+
+# %% [markdown]
+# #### Summarising the terms in each cluster
+# ``get_wordcloud`` rebuilds the text of every review in a cluster each time a word cloud is drawn. For larger datasets, the term frequencies of every cluster can instead be calculated in one step from the TF-IDF matrix that has already been built, and the word clouds drawn directly from those frequencies.
+#
+# Note that the TF-IDF terms come from the full clean of the reviews, so they are stemmed and lemmatised (e.g. 'insurance' becomes 'insur'). The hidden words are cleaned in the same way so that they match.
+
+# %%
+terms = tfidf.get_feature_names_out()
+hidden_terms = [wnl.lemmatize(ps.stem(word)) for word in hidden_words]
+term_frequencies_tfidf = cluster_term_frequencies(
+    embedding_tfidf, labels_tfidf_kmeans, terms, blacklist=hidden_terms)
+
+# Show the ten most important terms in each cluster.
+print(top_terms(term_frequencies_tfidf, terms, n=10))
+
+for each in range(0, K):
+    plot_wordcloud(term_frequencies_tfidf, terms, each)
+
+# %% [markdown]
+# #### Starting up quickly
+# Importing the ``sentiment_pipeline`` functions does not import nltk, scikit-learn, sentence-transformers or wordcloud; each of these is only imported by the functions that use it. Together with the saved symspell dictionary, this means that a worker process, or a script that only cleans text, can start in a fraction of a second rather than several seconds.
+#
+# ``check_import_time`` imports each module of the pipeline in a new Python process and checks that it is within its time budget and does not import any of the heavy packages. Here it shows a table of the results; called with the default ``raise_error=True`` (as in ``cookbook/docs/tests``), it raises an error if any module is over its budget, so it can be used as a test when the pipeline is changed.
+
+# %%
+import_times = check_import_time(raise_error=False)
+pd.DataFrame(import_times)
+
+# %% [markdown]
+# #### Where the time goes
+# The main steps of the notebook were timed by the ``RunProfiler`` created at the top of the notebook. For each step, it records the wall time, the CPU time (including worker processes, e.g. for the cleaning), the peak memory used and the number of reviews processed per second.
+#
+# To see which functions a step spends its time in, the step can be run with ``profile='cprofile'``. The slowest functions are kept in the run report, and the full profile is saved in the ``DAA_M07_CS2_profiles`` folder (it can be viewed with e.g. ``snakeviz``). Note that only the notebook's own process is profiled, so the example below cleans 1,000 reviews in the notebook process (``n_jobs=1``) rather than in worker processes. ``profile='pyinstrument'`` uses the pyinstrument sampling profiler instead, and saves the profile as a web page.
+
+# %%
+with profiler.stage('cleaning 1,000 reviews', n_items=1000, profile='cprofile') as record:
+    clean_column(dataset['body'][:1000], n_jobs=1, spelling_table_path=spelling_table_path,
+                 sym_spell_index=sym_spell_index)
+pd.DataFrame(record['top_functions'])
+
+# %% [markdown]
+# The results of all of the steps, including the profiled example above, are saved to a JSON run report, and also added to a log file with one line per run, so that runs can be compared as the number of reviews grows (e.g. to spot a step that is getting slower than expected).
+
+# %%
+profiler.save('DAA_M07_CS2_run_report.json', history_path='DAA_M07_CS2_run_log.jsonl')
+profiler.summary()
+
+# %%
+# Compare the wall time of each step over all of the runs in the log.
+history = load_history('DAA_M07_CS2_run_log.jsonl')
+history.pivot_table(index='started_at', columns='stage', values='wall_seconds')
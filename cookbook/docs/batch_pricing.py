@@ -0,0 +1,260 @@
+"""
+Pricing many travel insurance quotes at once.
+
+Used by the *Py: Productionising predictive models as API* notebook
+(predict_API_gradio.ipynb).
+
+``price`` in the notebook prices one quote per call, parsing the dates with
+``strptime`` and calling a lambda for each factor, and each API call prices a
+single quote. For a high number of quotes per second:
+- ``price_batch`` prices arrays of quotes with NumPy array operations, giving
+  the same results as ``price``;
+- ``make_server`` starts a small HTTP server (using only the standard
+  library) with a ``/price_batch`` endpoint for batches of quotes, and a
+  ``/run/predict`` endpoint that accepts the same single quotes as the gradio
+  API;
+- the single quotes are queued and priced together in micro-batches, waiting
+  at most a couple of milliseconds for a batch to fill; and
+- ``/stats`` reports the number of quotes priced and the p50 and p99 latency.
+
+It can also be run from the command line:
+
+    python batch_pricing.py --port 7861
+"""
+
+import argparse
+import json
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+# The factors from ``price`` in the notebook (all fictional)
+BASE_PRICE_PER_DAY = 7
+USA_FACTOR = 2.0
+OLDER_AGE = 70
+OLDER_AGE_FACTOR = 2.5
+SKI_FACTOR = 1.7
+TAX_RATE = 0.12
+
+QUOTE_FIELDS = ('destination', 'age1', 'age2', 'start_date', 'end_date', 'ski_cover')
+
+
+def price_batch(destination, age1, age2, start_date, end_date, ski_cover):
+    """
+    Return the price of travel insurance for arrays of quotes
+
+    Each argument is an array (or list) with one entry per quote, in the same
+    form as the arguments of ``price``. Returns arrays of the prices before tax
+    and the taxes.
+    """
+    destination = np.asarray(destination)
+    age1 = np.asarray(age1, dtype=float)
+    age2 = np.asarray(age2, dtype=float)
+    ski_cover = np.asarray(ski_cover, dtype=bool)
+
+    # ISO dates (YYYY-MM-DD) are converted to datetime64 without a loop.
+    start = np.asarray(start_date, dtype='datetime64[D]')
+    end = np.asarray(end_date, dtype='datetime64[D]')
+    trip_duration = (end - start).astype(int) + 1
+    if np.any(trip_duration <= 0):
+        bad = np.flatnonzero(trip_duration <= 0)
+        raise ValueError(f'end_date is before start_date for quotes {bad[:10].tolist()}')
+
+    dest_factor = np.where(destination == 'USA', USA_FACTOR, 1.0)
+    age_factor1 = np.where(age1 > OLDER_AGE, OLDER_AGE_FACTOR, 1.0)
+    # Age2 = -1 for no second traveller
+    age_factor2 = np.where(age2 > 0, np.where(age2 > OLDER_AGE, OLDER_AGE_FACTOR, 1.0), 0.0)
+    ski_factor = np.where(ski_cover, SKI_FACTOR, 1.0)
+
+    price_before_tax = (BASE_PRICE_PER_DAY * trip_duration * dest_factor
+                        * (age_factor1 + age_factor2) * ski_factor)
+    taxes = np.round(np.round(price_before_tax, 2) * TAX_RATE, 2)
+    return price_before_tax, taxes
+
+
+def price_quotes(quotes):
+    """
+    Prices a DataFrame, a list of dictionaries, or a dictionary of lists of
+    quotes, with the fields in QUOTE_FIELDS. Returns a DataFrame with the
+    price and tax of each quote.
+    """
+    quotes = pd.DataFrame(quotes)
+    missing = [field for field in QUOTE_FIELDS if field not in quotes]
+    if missing:
+        raise ValueError(f'Quotes are missing the fields {missing}')
+    prices, taxes = price_batch(*(quotes[field].to_numpy() for field in QUOTE_FIELDS))
+    return pd.DataFrame({'price': prices, 'tax': taxes}, index=quotes.index)
+
+
+class LatencyTracker:
+    """Keeps the most recent request latencies, to report percentiles."""
+
+    def __init__(self, max_samples=100000):
+        self.latencies = deque(maxlen=max_samples)
+        self.requests = 0
+        self.quotes = 0
+        self.batches = 0
+        self.lock = threading.Lock()
+
+    def record(self, seconds, n_quotes=1):
+        with self.lock:
+            self.latencies.append(seconds)
+            self.requests += 1
+            self.quotes += n_quotes
+
+    def summary(self):
+        with self.lock:
+            latencies = np.array(self.latencies) * 1000 if self.latencies else np.zeros(1)
+            return {'requests': self.requests,
+                    'quotes': self.quotes,
+                    'micro_batches': self.batches,
+                    'latency_ms_p50': round(float(np.percentile(latencies, 50)), 3),
+                    'latency_ms_p99': round(float(np.percentile(latencies, 99)), 3)}
+
+
+class MicroBatcher:
+    """
+    Collects single quotes from many requests and prices them together.
+
+    A background thread takes quotes from a queue until it has max_batch_size
+    quotes or max_wait seconds have passed since the first one, prices them
+    with one call of ``price_batch``, and hands each result back to the
+    request that is waiting for it.
+    """
+
+    def __init__(self, max_batch_size=1024, max_wait=0.002, tracker=None):
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.tracker = tracker
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, quote):
+        """Queues one quote (a tuple in the order of QUOTE_FIELDS); returns a Future."""
+        future = Future()
+        self.queue.put((quote, future))
+        return future
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                try:
+                    batch.append(self.queue.get(timeout=remaining) if remaining > 0
+                                 else self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._price(batch)
+
+    def _price(self, batch):
+        quotes = [quote for quote, _ in batch]
+        try:
+            prices, taxes = price_batch(*zip(*quotes))
+        except Exception:
+            # Price the quotes one at a time, so one bad quote only fails its
+            # own request.
+            for quote, future in batch:
+                try:
+                    prices, taxes = price_batch(*([value] for value in quote))
+                    future.set_result((float(prices[0]), float(taxes[0])))
+                except Exception as e:
+                    future.set_exception(e)
+        else:
+            for (_, future), p, t in zip(batch, prices.tolist(), taxes.tolist()):
+                future.set_result((p, t))
+        if self.tracker is not None:
+            with self.tracker.lock:
+                self.tracker.batches += 1
+
+
+def _handler(batcher, tracker):
+
+    class PricingHandler(BaseHTTPRequestHandler):
+
+        def _reply(self, status, body):
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == '/stats':
+                self._reply(200, tracker.summary())
+            else:
+                self._reply(404, {'error': 'not found'})
+
+        def do_POST(self):
+            start = time.perf_counter()
+            try:
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                if self.path == '/run/predict':
+                    # The same request as the gradio API: {"data": [destination, age1, ...]}
+                    prices = batcher.submit(tuple(body['data'])).result()
+                    result, n_quotes = {'data': list(prices)}, 1
+                elif self.path == '/price_batch':
+                    # {"quotes": [{...}, ...]} or {"destination": [...], "age1": [...], ...}
+                    priced = price_quotes(body.get('quotes', body))
+                    result, n_quotes = {'price': priced['price'].tolist(),
+                                        'tax': priced['tax'].tolist()}, len(priced)
+                else:
+                    self._reply(404, {'error': 'not found'})
+                    return
+            except (ValueError, KeyError, TypeError) as e:
+                self._reply(400, {'error': str(e)})
+                return
+            tracker.record(time.perf_counter() - start, n_quotes)
+            self._reply(200, result)
+
+        def log_message(self, format, *args):
+            pass  # Do not print a line for every request
+
+    return PricingHandler
+
+
+class PricingServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Allow many clients to connect at once (the default queue is 5).
+    request_queue_size = 1024
+
+
+def make_server(host='127.0.0.1', port=7861, max_batch_size=1024, max_wait=0.002):
+    """
+    Creates the pricing HTTP server. Call ``serve_forever()`` on the result to
+    start it, e.g. in a thread from a notebook, and ``shutdown()`` to stop it.
+    """
+    tracker = LatencyTracker()
+    batcher = MicroBatcher(max_batch_size, max_wait, tracker)
+    server = PricingServer((host, port), _handler(batcher, tracker))
+    server.tracker = tracker
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve the travel insurance pricing API.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=7861)
+    parser.add_argument('--max-batch-size', type=int, default=1024)
+    parser.add_argument('--max-wait-ms', type=float, default=2.0)
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port, args.max_batch_size, args.max_wait_ms / 1000)
+    print(f'Serving on http://{args.host}:{args.port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(json.dumps(server.tracker.summary()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,240 @@
+"""
+Compressing many CSV files at once.
+
+Used by the *Zipping CSV files* notebook (Zipping CSV files.ipynb).
+
+The notebook zips each CSV file in a folder one after another, and changes
+the working directory so that the file is stored in the zip file without its
+folder. ``compress_files`` instead:
+- compresses the files on a pool of processes;
+- reads and writes each file in chunks, so large files are never held in
+  memory;
+- can write zip files (as in the notebook), gzip or zstd files, or Parquet
+  files, all of which pandas can read directly (``pd.read_csv`` or
+  ``pd.read_parquet``);
+- keeps a manifest of the files already compressed with a hash of their
+  contents, so files that have not changed since the last run are skipped; and
+- names the file inside each zip file with ``arcname``, so there is no need to
+  change the working directory.
+
+It can also be run from the command line:
+
+    python compress_csv.py source_folder --dest dest_folder --codec zstd
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+CHUNK_SIZE = 2**20  # 1MB
+MANIFEST_NAME = '.compress_manifest.json'
+EXTENSIONS = {'zip': '.zip', 'gzip': '.csv.gz', 'zstd': '.csv.zst', 'parquet': '.parquet'}
+
+
+def csv_files(source_dir, pattern='*.csv'):
+    """The CSV files in source_dir, in name order."""
+    return sorted(path for path in Path(source_dir).expanduser().glob(pattern)
+                  if path.is_file())
+
+
+def file_hash(path, chunk_size=CHUNK_SIZE):
+    """A hash of the contents of a file, read in chunks."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _write_zip(source, target, level):
+    with zipfile.ZipFile(target, 'w', zipfile.ZIP_DEFLATED, compresslevel=level) as zf:
+        # arcname stores the file without its folder, like the notebook does
+        # by changing to the folder first.
+        with open(source, 'rb') as f_in, zf.open(source.name, 'w', force_zip64=True) as f_out:
+            shutil.copyfileobj(f_in, f_out, CHUNK_SIZE)
+
+
+def _write_gzip(source, target, level):
+    with open(source, 'rb') as f_in, \
+            gzip.open(target, 'wb', compresslevel=9 if level is None else level) as f_out:
+        shutil.copyfileobj(f_in, f_out, CHUNK_SIZE)
+
+
+def _write_zstd(source, target, level):
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("The zstd codec needs the zstandard package: pip install zstandard")
+    compressor = zstandard.ZstdCompressor(level=3 if level is None else level)
+    with open(source, 'rb') as f_in, open(target, 'wb') as f_out:
+        compressor.copy_stream(f_in, f_out, read_size=CHUNK_SIZE, write_size=CHUNK_SIZE)
+
+
+def _write_parquet(source, target, level):
+    # pyarrow reads the CSV in blocks and each block is written as a row
+    # group, so the whole table is never in memory. The column types are
+    # worked out from the first block.
+    import pyarrow.csv
+    import pyarrow.parquet
+
+    reader = pyarrow.csv.open_csv(source, read_options=pyarrow.csv.ReadOptions(
+        block_size=64 * CHUNK_SIZE))
+    with pyarrow.parquet.ParquetWriter(target, reader.schema, compression='zstd',
+                                       compression_level=level) as writer:
+        for batch in reader:
+            writer.write_batch(batch)
+
+
+WRITERS = {'zip': _write_zip, 'gzip': _write_gzip, 'zstd': _write_zstd,
+           'parquet': _write_parquet}
+
+
+def compress_file(source, dest_dir, codec='zip', level=None, known_hash=None):
+    """
+    Compresses one file into dest_dir.
+
+    If known_hash is given and the file's contents still have that hash, the
+    file is not compressed again. Returns a dictionary describing the result,
+    as saved in the manifest.
+    """
+    source = Path(source)
+    target = Path(dest_dir) / (source.stem + EXTENSIONS[codec])
+    stat = source.stat()
+    record = {'source': source.name, 'output': target.name, 'codec': codec, 'level': level,
+              'size': stat.st_size, 'mtime': stat.st_mtime}
+
+    start = time.perf_counter()
+    record['hash'] = file_hash(source)
+    if record['hash'] == known_hash and target.exists():
+        record['status'] = 'unchanged'
+    else:
+        # Write to a temporary file first, so a run that is stopped part way
+        # never leaves a partly written file under the final name.
+        partial = target.with_name(target.name + '.partial')
+        WRITERS[codec](source, partial, level)
+        os.replace(partial, target)
+        record['status'] = 'compressed'
+    record['compressed_size'] = target.stat().st_size
+    record['seconds'] = time.perf_counter() - start
+    return record
+
+
+def _load_manifest(path):
+    if path.exists():
+        with open(path) as f:
+            return json.load(f)
+    return {}
+
+
+def _save_manifest(path, manifest):
+    partial = path.with_name(path.name + '.partial')
+    with open(partial, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(partial, path)
+
+
+def compress_files(source_dir, dest_dir=None, codec='zip', level=None, n_jobs=None,
+                   pattern='*.csv', force=False):
+    """
+    Compresses every CSV file in source_dir into dest_dir (source_dir by
+    default), with codec 'zip', 'gzip', 'zstd' or 'parquet'.
+
+    A manifest in dest_dir records the hash of each file compressed and the
+    compression level used. Files whose size and modification time match the
+    manifest are skipped without being read; files that have been touched but
+    whose contents hash the same are not compressed again. A file is always
+    compressed again if the level has changed, and force=True compresses
+    every file.
+
+    The files are compressed on n_jobs processes (all cores by default). If
+    any files fail, the others are still compressed and saved in the
+    manifest, and then a RuntimeError is raised.
+    Returns a list of the manifest records of the files.
+    """
+    if codec not in WRITERS:
+        raise ValueError(f"codec must be one of {list(WRITERS)}, not '{codec}'")
+    source_dir = Path(source_dir).expanduser()
+    dest_dir = source_dir if dest_dir is None else Path(dest_dir).expanduser()
+    dest_dir.mkdir(parents=True, exist_ok=True)
+    manifest_path = dest_dir / MANIFEST_NAME
+    # Even with force=True, the records of files that are not compressed in
+    # this run (e.g. that no longer match pattern) are kept.
+    manifest = _load_manifest(manifest_path)
+
+    records, to_compress = [], []
+    for path in csv_files(source_dir, pattern):
+        # The manifest is keyed by the compressed file, so the same folder can
+        # be compressed with more than one codec.
+        output = path.stem + EXTENSIONS[codec]
+        previous = manifest.get(output)
+        if force or (previous and previous.get('level') != level):
+            previous = None
+        stat = path.stat()
+        if (previous and (previous['size'], previous['mtime']) == (stat.st_size, stat.st_mtime)
+                and (dest_dir / output).exists()):
+            records.append(dict(previous, status='unchanged'))
+            continue
+        to_compress.append((path, previous['hash'] if previous else None))
+    print(f'{len(records)} files unchanged, {len(to_compress)} to check and compress.')
+
+    if n_jobs is None:
+        n_jobs = os.cpu_count() or 1
+    errors = []
+
+    def add(path, result):
+        try:
+            record = result()
+        except Exception as e:
+            print(f'Could not compress {path.name}: {e!r}')
+            errors.append(e)
+        else:
+            manifest[record['output']] = record
+            records.append(record)
+
+    try:
+        if n_jobs == 1:
+            for path, known_hash in to_compress:
+                add(path, lambda: compress_file(path, dest_dir, codec, level, known_hash))
+        else:
+            with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+                futures = {executor.submit(compress_file, path, dest_dir, codec, level,
+                                           known_hash): path
+                           for path, known_hash in to_compress}
+                for future in as_completed(futures):
+                    add(futures[future], future.result)
+    finally:
+        # Save what has been done, even if a file fails or the run is stopped.
+        _save_manifest(manifest_path, manifest)
+    if errors:
+        raise RuntimeError(f'{len(errors)} of {len(to_compress)} files could not be '
+                           f'compressed') from errors[0]
+
+    n_compressed = sum(record['status'] == 'compressed' for record in records)
+    print(f'Compressed {n_compressed} of {len(records)} files.')
+    return sorted(records, key=lambda record: record['source'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compress the CSV files in a folder.')
+    parser.add_argument('source_dir')
+    parser.add_argument('--dest', dest='dest_dir', default=None)
+    parser.add_argument('--codec', choices=list(WRITERS), default='zip')
+    parser.add_argument('--level', type=int, default=None, help='compression level')
+    parser.add_argument('--n-jobs', type=int, default=None)
+    parser.add_argument('--pattern', default='*.csv')
+    parser.add_argument('--force', action='store_true',
+                        help='compress every file, even if it has not changed')
+    args = parser.parse_args()
+    compress_files(args.source_dir, args.dest_dir, args.codec, args.level, args.n_jobs,
+                   args.pattern, args.force)
+
+
+if __name__ == '__main__':
+    main()
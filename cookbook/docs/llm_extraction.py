@@ -0,0 +1,218 @@
+"""
+Concurrent extraction of structured data from reviews with an LLM.
+
+Used by the *Py: LLM Unstructured Text Transformation* notebook
+(py_llm_text_sentiment.ipynb) to run the analysis on the full dataset rather
+than the first 50 reviews.
+
+``extract_full_analysis`` in the notebook sends one review at a time and waits
+for each answer before sending the next. An LLM server such as Ollama can work
+on several requests at once, so ``run_extraction`` instead:
+- sends up to ``concurrency`` requests at the same time (using asyncio);
+- retries, with a growing wait between attempts, when a response is not valid
+  JSON or is missing one of the expected fields;
+- appends each result to a JSON lines file keyed by a hash of the model and
+  the prompt (which includes the review), so that a run that is stopped part
+  way can be restarted without repeating the reviews already done, while a
+  change to the prompt sends the reviews again; and
+- reports the throughput and the response times of the requests.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import random
+import time
+
+import numpy as np
+
+EXPECTED_FIELDS = ('sentiment', 'feedback_category', 'specific_issue')
+ERROR_RESULT = {field: 'Error' for field in EXPECTED_FIELDS}
+
+
+def build_prompt(review_text: str) -> str:
+    """The prompt used by ``extract_full_analysis`` in the notebook."""
+    return f"""
+You are a senior Customer Experience Analyst. Your task is to analyze the following review
+and return a single, valid JSON object and nothing else.
+
+1. "sentiment": Classify the sentiment. Must be one of: "Positive", "Negative", or "Neutral".
+2.  "feedback_category": Classify the primary subject of the customer's feedback. Must be one of the following strings:
+    - "Product Design & Wording": Feedback on policy coverage, exclusions, price, or clarity of the Product Disclosure Statement (PDS).
+    - "Sales & Purchase Process": Feedback on the experience of buying the policy online or via an agent.
+    - "Claims Process": Feedback on the experience of submitting, managing, or the outcome of a formal claim.
+    - "Customer Support & Communication": Feedback on general interactions with staff via phone or email.
+    - "Emergency Assistance (24/7 Support)": Specific feedback on using the emergency helpline during a trip.
+    - "Factual Claim Notification": The customer is stating facts to lodge a claim without providing feedback on service or product yet.
+3.  "specific_issue": Identify the specific event or item mentioned (e.g., "flight cancellation", "lost baggage", "confusing PDS", "helpful agent"). If none, use "N/A".
+
+Review:
+"{review_text}"
+
+JSON Output:"""
+
+
+def review_hash(review_text: str, model: str) -> str:
+    """
+    A hash of the model and the prompt for the review, used as the key in the
+    result log. Results from an earlier version of the prompt are not reused.
+    """
+    prompt = build_prompt(review_text)
+    return hashlib.sha256(f'{model}\n{prompt}'.encode('utf-8')).hexdigest()
+
+
+class ResultLog:
+    """
+    An append-only JSON lines file of results, one line per review.
+
+    Each line holds the review hash and the extracted fields. When the file is
+    opened again the results already in it are read back, so finished reviews
+    are not sent to the LLM again.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.results = {}
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A line cut short when a run was stopped.
+                        continue
+                    self.results[record['hash']] = record['result']
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.results
+
+    def add(self, key: str, result: dict):
+        self.results[key] = result
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({'hash': key, 'result': result}) + '\n')
+
+
+def parse_response(content: str) -> dict:
+    """
+    Parses the LLM response. Raises json.JSONDecodeError if it is not valid
+    JSON, or ValueError if it is not a JSON object with all of the expected
+    fields.
+    """
+    data = json.loads(content)
+    if not isinstance(data, dict):
+        raise ValueError('Response is not a JSON object')
+    missing = [field for field in EXPECTED_FIELDS if field not in data]
+    if missing:
+        raise ValueError(f'Response is missing the fields {missing}')
+    return {field: data[field] for field in EXPECTED_FIELDS}
+
+
+async def extract_one(client, review_text: str, model: str, semaphore: asyncio.Semaphore,
+                      stats: dict, max_retries: int = 3, backoff: float = 1.0) -> dict:
+    """
+    Sends one review to the LLM, retrying if the response cannot be used.
+
+    The wait before retry n is about backoff * 2 ** n seconds, with some random
+    jitter so that retries from many requests do not all arrive together.
+    """
+    for attempt in range(max_retries + 1):
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                response = await client.chat.completions.create(
+                    model=model,
+                    messages=[{'role': 'user', 'content': build_prompt(review_text)}],
+                    response_format={'type': 'json_object'},
+                    temperature=0,
+                )
+                result = parse_response(response.choices[0].message.content)
+                stats['latencies'].append(time.perf_counter() - start)
+                return result
+            except json.JSONDecodeError:
+                error = 'invalid JSON'
+            except ValueError as e:
+                # Valid JSON, but not the fields asked for.
+                error = str(e)
+            except Exception as e:
+                error = str(e)
+            stats['latencies'].append(time.perf_counter() - start)
+
+        if attempt < max_retries:
+            stats['retries'] += 1
+            await asyncio.sleep(backoff * 2 ** attempt * (0.5 + random.random()))
+
+    print(f'\nGiving up on a review after {max_retries + 1} attempts: {error}')
+    stats['failed'] += 1
+    return dict(ERROR_RESULT)
+
+
+def summarise_stats(stats: dict, seconds: float, n_sent: int, n_cached: int) -> dict:
+    """Throughput and response time percentiles of a run."""
+    latencies = np.array(stats['latencies']) if stats['latencies'] else np.zeros(1)
+    return {
+        'reviews_sent': n_sent,
+        'reviews_from_log': n_cached,
+        'retries': stats['retries'],
+        'failed': stats['failed'],
+        'seconds': round(seconds, 2),
+        'reviews_per_second': round(n_sent / seconds, 2) if seconds > 0 else None,
+        'latency_p50': round(float(np.percentile(latencies, 50)), 3),
+        'latency_p95': round(float(np.percentile(latencies, 95)), 3),
+        'latency_p99': round(float(np.percentile(latencies, 99)), 3),
+    }
+
+
+async def run_extraction(reviews, client, model: str, log_path: str, concurrency: int = 8,
+                         max_retries: int = 3, backoff: float = 1.0):
+    """
+    Extracts the sentiment, feedback category and specific issue of each review.
+
+    client should be an ``openai.AsyncOpenAI`` client, e.g. pointing at a local
+    Ollama server with ``base_url='http://localhost:11434/v1'``. Ollama only
+    works on several requests at once if ``OLLAMA_NUM_PARALLEL`` is set when
+    the server is started.
+
+    Returns a list of results (dictionaries) in the same order as the reviews,
+    and a dictionary of throughput and latency statistics.
+
+    In a notebook, use ``await run_extraction(...)``; in a script, use
+    ``asyncio.run(run_extraction(...))``.
+    """
+    reviews = list(reviews)
+    keys = [review_hash(review, model) for review in reviews]
+    log = ResultLog(log_path)
+
+    # Only send each distinct review that is not already in the log.
+    to_send = {}
+    for key, review in zip(keys, reviews):
+        if key not in log and key not in to_send:
+            to_send[key] = review
+    n_cached = len(set(keys)) - len(to_send)
+    print(f'{n_cached} reviews already in the log, {len(to_send)} to send to {model}.')
+
+    semaphore = asyncio.Semaphore(concurrency)
+    stats = {'latencies': [], 'retries': 0, 'failed': 0}
+
+    async def extract_and_log(key, review):
+        result = await extract_one(client, review, model, semaphore, stats,
+                                   max_retries, backoff)
+        # Failed reviews are not logged, so that they are tried again next run.
+        if result != ERROR_RESULT:
+            log.add(key, result)
+        return key, result
+
+    start = time.perf_counter()
+    tasks = [asyncio.create_task(extract_and_log(key, review))
+             for key, review in to_send.items()]
+    new_results = {}
+    for n_done, task in enumerate(asyncio.as_completed(tasks), start=1):
+        key, result = await task
+        new_results[key] = result
+        if n_done % 100 == 0 or n_done == len(tasks):
+            print(f'{n_done}/{len(tasks)} reviews done '
+                  f'({n_done / (time.perf_counter() - start):.1f} per second)')
+    seconds = time.perf_counter() - start
+
+    results = [new_results.get(key, log.results.get(key)) for key in keys]
+    return results, summarise_stats(stats, seconds, len(to_send), n_cached)
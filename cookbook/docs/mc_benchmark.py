@@ -0,0 +1,251 @@
+"""
+A repeatable benchmark of the Monte Carlo option pricers.
+
+Used by the *Py: Python for Performance* notebook (Performance_gottagofaster.ipynb).
+
+The ``%%time`` cells in the notebook time a single run, and the first call of a
+``numba.jit`` function includes the time taken to compile it. ``run_benchmark``
+instead, for each pricer and each number of simulations ``n``:
+- runs the pricer once as a warm-up, and records that time separately (for the
+  numba pricers this is mostly compile time);
+- times a number of repeated runs, and records the minimum, median, mean and
+  standard deviation; and
+- runs it once more while tracing memory, to record the peak memory used
+  (except for the numba pricers, whose memory cannot be traced).
+
+The results are saved to a JSON file together with the package versions and
+machine details, and ``compare_results`` compares two such files to find
+pricers that have become slower or use more memory.
+
+It can also be run from the command line:
+
+    python mc_benchmark.py --output results.json --n 10000 100000 1000000
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from mc_pricing import price_book
+
+# The option priced in the notebook
+SPOT, STRIKE, VOL, RATE, TERM = 100, 110, 0.45, 0.02, 1.5
+
+# Pricers that allocate their memory inside numba compiled code, which
+# tracemalloc cannot see.
+UNTRACED_PRICERS = ('numba_loop', 'numba_vectorised')
+
+
+def mcBScall_loop(S, K, sgm, r, T, n):
+    payoff_sim = 0.0
+    for i in range(n):
+        w = np.random.standard_normal()
+        ST = S * np.exp((r - 0.5 * sgm**2) * T + sgm * np.sqrt(T) * w)
+        payoff = ST - K
+        payoff = payoff * (payoff > 0)
+        payoff_sim += payoff
+    return np.exp(-r * T) * payoff_sim / n
+
+
+def mcBScall_vect(S, K, sgm, r, T, n):
+    w = np.random.standard_normal(n)
+    ST = S * np.exp((r - 0.5 * sgm**2) * T + sgm * np.sqrt(T) * w)
+    payoff = ST - K
+    payoff = payoff * (payoff > 0)
+    return np.exp(-r * T) * np.mean(payoff)
+
+
+def _seed(seed):
+    np.random.seed(seed)
+
+
+_numba_seed = None
+
+
+def seed_random(seed):
+    """
+    Seeds NumPy's random numbers and, if numba is installed, numba's.
+
+    numba compiled functions use their own random number generator, which
+    ``np.random.seed`` does not affect unless it is called inside a compiled
+    function.
+    """
+    global _numba_seed
+    np.random.seed(seed)
+    try:
+        from numba import jit
+    except ImportError:
+        return
+    if _numba_seed is None:
+        _numba_seed = jit(nopython=True)(_seed)
+    _numba_seed(seed)
+
+
+def get_pricers(include_slow=True):
+    """
+    The pricers to benchmark, as {name: function(n)}.
+
+    The numba pricers are only included if numba is installed. They are
+    compiled again here (rather than reusing a compiled function) so that the
+    warm-up time includes the compile time, as in the notebook.
+    """
+    pricers = {}
+    if include_slow:
+        pricers['loop'] = lambda n: mcBScall_loop(SPOT, STRIKE, VOL, RATE, TERM, n)
+    pricers['vectorised'] = lambda n: mcBScall_vect(SPOT, STRIKE, VOL, RATE, TERM, n)
+
+    try:
+        from numba import jit
+    except ImportError:
+        print('numba is not installed, skipping the numba pricers.')
+    else:
+        numba_loop = jit(nopython=True)(mcBScall_loop)
+        numba_vect = jit(nopython=True)(mcBScall_vect)
+        pricers['numba_loop'] = lambda n: numba_loop(SPOT, STRIKE, VOL, RATE, TERM, n)
+        pricers['numba_vectorised'] = lambda n: numba_vect(SPOT, STRIKE, VOL, RATE, TERM, n)
+
+    pricers['batched'] = lambda n: price_book(SPOT, STRIKE, VOL, RATE, TERM, n_paths=n,
+                                              antithetic=False, control_variate=False,
+                                              n_jobs=1)
+    pricers['batched_variance_reduction'] = lambda n: price_book(
+        SPOT, STRIKE, VOL, RATE, TERM, n_paths=n, n_jobs=1)
+    return pricers
+
+
+def _time(function, n):
+    start = time.perf_counter()
+    function(n)
+    return time.perf_counter() - start
+
+
+def _peak_memory_mb(function, n):
+    # tracemalloc sees memory allocated by Python and NumPy, but not memory
+    # allocated inside numba compiled code.
+    tracemalloc.start()
+    function(n)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / 2**20
+
+
+def environment():
+    """Details of the machine and package versions, saved with the results."""
+    details = {'python': platform.python_version(),
+               'platform': platform.platform(),
+               'processor': platform.processor(),
+               'cpu_count': os.cpu_count(),
+               'numpy': np.__version__,
+               'pandas': pd.__version__}
+    try:
+        import numba
+        details['numba'] = numba.__version__
+    except ImportError:
+        details['numba'] = None
+    return details
+
+
+def run_benchmark(n_values=(10000, 100000, 1000000), repeats=5, pricers=None, seed=0,
+                  output=None, untraced=UNTRACED_PRICERS):
+    """
+    Benchmarks each pricer for each n in n_values.
+
+    The peak memory of the pricers named in untraced is recorded as None, as
+    tracemalloc would report close to 0MB for them.
+
+    Returns a DataFrame with one row per pricer and n. If output is given, the
+    results are also saved to that JSON file.
+    """
+    if pricers is None:
+        pricers = get_pricers()
+
+    results = []
+    for name, pricer in pricers.items():
+        for n in n_values:
+            seed_random(seed)
+            warm_up = _time(pricer, n)
+            times = [_time(pricer, n) for _ in range(repeats)]
+            results.append({'pricer': name,
+                            'n': n,
+                            'warm_up_seconds': warm_up,
+                            'min_seconds': min(times),
+                            'median_seconds': statistics.median(times),
+                            'mean_seconds': statistics.mean(times),
+                            'std_seconds': statistics.stdev(times) if repeats > 1 else 0.0,
+                            'repeats': repeats,
+                            'times': times,
+                            'peak_memory_mb': (None if name in untraced
+                                               else _peak_memory_mb(pricer, n))})
+            print(f"{name:>28} n={n:<9} median {results[-1]['median_seconds']:.4f}s")
+
+    if output is not None:
+        with open(output, 'w') as f:
+            json.dump({'created': datetime.now().isoformat(timespec='seconds'),
+                       'environment': environment(),
+                       'results': results}, f, indent=2)
+    return pd.DataFrame(results).drop(columns='times')
+
+
+def load_results(path):
+    """Reads a results file saved by ``run_benchmark`` into a DataFrame."""
+    with open(path) as f:
+        return pd.DataFrame(json.load(f)['results']).drop(columns='times')
+
+
+def compare_results(baseline_path, new_path, threshold=0.1, min_memory_mb=1.0):
+    """
+    Compares two results files.
+
+    Returns a DataFrame of the median times and peak memory in each file, and
+    flags the pricers that are more than threshold (10% by default) slower, or
+    that use more than threshold more memory, in the new file. Changes in
+    memory of less than min_memory_mb are ignored, as the peak memory of the
+    smaller runs is too small to compare as a ratio, and pricers without a
+    peak memory (see ``run_benchmark``) are only compared on time. The median
+    is used rather than the mean as it is less affected by an unusually slow
+    run.
+    """
+    baseline = load_results(baseline_path).set_index(['pricer', 'n'])
+    new = load_results(new_path).set_index(['pricer', 'n'])
+    comparison = pd.DataFrame({'baseline_seconds': baseline['median_seconds'],
+                               'new_seconds': new['median_seconds'],
+                               'baseline_memory_mb': baseline['peak_memory_mb'],
+                               'new_memory_mb': new['peak_memory_mb']})
+    comparison = comparison.dropna(subset=['baseline_seconds', 'new_seconds'])
+    comparison['ratio'] = comparison['new_seconds'] / comparison['baseline_seconds']
+    comparison['memory_ratio'] = (comparison['new_memory_mb']
+                                  / comparison['baseline_memory_mb'].clip(lower=1e-6))
+    comparison['time_regression'] = comparison['ratio'] > 1 + threshold
+    comparison['memory_regression'] = (
+        (comparison['memory_ratio'] > 1 + threshold)
+        & (comparison['new_memory_mb'] - comparison['baseline_memory_mb'] > min_memory_mb))
+    comparison['regression'] = comparison['time_regression'] | comparison['memory_regression']
+    return comparison
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the Monte Carlo option pricers.')
+    parser.add_argument('--output', default='mc_benchmark_results.json')
+    parser.add_argument('--n', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--skip-loop', action='store_true',
+                        help='leave out the slow pure Python loop pricer')
+    parser.add_argument('--compare', help='a previous results file to compare against')
+    args = parser.parse_args()
+
+    results = run_benchmark(args.n, args.repeats, get_pricers(not args.skip_loop),
+                            output=args.output)
+    print(results.to_string(index=False))
+    if args.compare:
+        print(compare_results(args.compare, args.output).to_string())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,338 @@
+"""
+Comparing the tuned machine learning models on many triangles at once.
+
+Used by the *Py: Machine Learning Triangles* notebook (MLRWP_Py_triangles_example.ipynb).
+
+The notebook tunes each model with its own ``GridSearchCV`` or
+``RandomizedSearchCV``, one model after another, and refits the
+``ColumnTransformer`` preprocessing for every candidate in every fold.
+``run_comparison`` instead:
+- fits the preprocessing (e.g. the ``OneHotEncoder`` for the chain ladder GLM or
+  the ``MinMaxScaler`` for the neural network) once per cross-validation fold,
+  and reuses the transformed data for every candidate;
+- runs the search of every model, for every dataset, as a separate task on a
+  pool of processes, so the models are tuned at the same time;
+- optionally uses successive halving, where all candidates are first fitted on
+  a small part of the training data and only the best third (by default) go
+  on to the next round, with more data, until the last round which always
+  uses all of the training data; and
+- returns a leaderboard with the cross-validation RMSE (on all of the training
+  data) and fit time of the candidates, and the RMSE on the future (hold-out)
+  data of the best candidate of each model.
+
+It can also be run from the command line, e.g. on all four simulated datasets:
+
+    python model_comparison.py --datasets 1 2 3 4 --output model_leaderboard.csv
+"""
+
+import argparse
+import json
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from sklearn.base import clone
+from sklearn.compose import ColumnTransformer, TransformedTargetRegressor
+from sklearn.ensemble import (GradientBoostingRegressor, HistGradientBoostingRegressor,
+                              RandomForestRegressor)
+from sklearn.linear_model import PoissonRegressor
+from sklearn.model_selection import KFold, ParameterGrid, ParameterSampler
+from sklearn.neural_network import MLPRegressor
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import FunctionTransformer, MinMaxScaler, OneHotEncoder, StandardScaler
+from sklearn.tree import DecisionTreeRegressor
+
+DATA_URL = 'https://institute-and-faculty-of-actuaries.github.io/mlr-blog/csv/lasso_simdata{}.csv'
+FEATURES = ['acc', 'dev', 'cal', 'accf', 'devf']
+
+# The models and hyper-parameters tuned in the notebook. 'transformer' is the
+# preprocessing, fitted once per fold, and 'n_iter' is the number of random
+# candidates tried (None tries the whole grid).
+MODEL_FAMILIES = {
+    'Decision Tree': {
+        'estimator': DecisionTreeRegressor(),
+        'parameters': {'criterion': ['squared_error', 'poisson'],
+                       'max_depth': [2, 3, 5, 7, None],
+                       'ccp_alpha': [0.0, 0.2, 0.4, 0.6, 0.8]},
+        'n_iter': None,
+        'transformer': None,
+    },
+    'Random Forest': {
+        'estimator': RandomForestRegressor(),
+        'parameters': {'max_depth': [2, 3, 5, 7, None],
+                       'ccp_alpha': [0.0, 0.2, 0.4, 0.6, 0.8],
+                       'random_state': [0]},
+        'n_iter': None,
+        'transformer': None,
+    },
+    'Classic GBM': {
+        'estimator': GradientBoostingRegressor(),
+        'parameters': {'n_estimators': [100, 200, 300, 400, 500],
+                       'max_depth': [1, 2, 3, 5, 6],
+                       'learning_rate': [0.01, 0.02, 0.05, 0.1, 0.3],
+                       'subsample': [0.5, 0.7, 1.0]},
+        'n_iter': 25,
+        'transformer': None,
+    },
+    'Histogram GBM': {
+        'estimator': HistGradientBoostingRegressor(),
+        'parameters': {'loss': ['squared_error', 'poisson'],
+                       'max_iter': [100, 200, 300, 400, 500],
+                       'max_depth': [1, 2, 3, 5, 6],
+                       'learning_rate': [0.01, 0.02, 0.05, 0.1, 0.3]},
+        'n_iter': 100,
+        'transformer': None,
+    },
+    'Neural Network': {
+        # The notebook fits on log(payments / average payment) and
+        # exponentiates the predictions. Here the log payments are centred
+        # and scaled with a StandardScaler, which (unlike a lambda) can be
+        # sent to the worker processes.
+        'estimator': TransformedTargetRegressor(
+            regressor=MLPRegressor(),
+            transformer=Pipeline([('log', FunctionTransformer(np.log, np.exp)),
+                                  ('scale', StandardScaler())]),
+            check_inverse=False),
+        'parameters': {'regressor__hidden_layer_sizes': [(50,), (25, 25), (16, 16, 16),
+                                                         (12, 12, 12, 12), (30, 15, 5)],
+                       'regressor__alpha': [0.00001, 0.0001, 0.001, 0.01, 0.1],
+                       'regressor__activation': ['logistic', 'relu'],
+                       'regressor__random_state': [0],
+                       'regressor__max_iter': [200000]},
+        'n_iter': 25,
+        'transformer': ColumnTransformer([('zero_to_one', MinMaxScaler(), [0, 1, 2])],
+                                         remainder='drop'),
+    },
+    'Chain Ladder': {
+        'estimator': PoissonRegressor(alpha=0, max_iter=5000),
+        'parameters': {'alpha': [0]},
+        'n_iter': None,
+        'transformer': ColumnTransformer([('encoder', OneHotEncoder(handle_unknown='ignore'),
+                                           [3, 4])],
+                                         remainder='drop'),
+    },
+}
+
+
+def load_dataset(source):
+    """
+    Reads a dataset in the same form as the notebook's, with columns pmts, acc,
+    dev, cal and train_ind.
+
+    source can be 1 to 4 for the simulated datasets (lasso_simdata1 to 4), or
+    the path (or URL) of a CSV or Parquet file of another dataset.
+    """
+    if str(source) in ('1', '2', '3', '4'):
+        source = DATA_URL.format(source)
+    if str(source).lower().endswith('.parquet'):
+        dat = pd.read_parquet(source)
+    else:
+        dat = pd.read_csv(source)
+    dat = dat.astype({'pmts': np.float32, 'acc': np.float32, 'dev': np.float32,
+                      'cal': np.float32, 'train_ind': bool})
+    # Factors with zero index, as in the notebook
+    dat['accf'] = (dat.acc - 1).astype(int)
+    dat['devf'] = (dat.dev - 1).astype(int)
+    return dat
+
+
+def _candidates(family, seed):
+    if family['n_iter'] is None:
+        return list(ParameterGrid(family['parameters']))
+    n_candidates = min(family['n_iter'], len(ParameterGrid(family['parameters'])))
+    return list(ParameterSampler(family['parameters'], n_candidates, random_state=seed))
+
+
+def _preprocess_folds(X, y, folds, transformer):
+    # Fits the preprocessing once per fold, and returns the transformed
+    # training and test data of each fold for all the candidates to share.
+    cached = []
+    for train, test in folds:
+        if transformer is None:
+            X_train, X_test = X[train], X[test]
+        else:
+            fitted = clone(transformer).fit(X[train], y[train])
+            X_train, X_test = fitted.transform(X[train]), fitted.transform(X[test])
+        cached.append((X_train, y[train], X_test, y[test]))
+    return cached
+
+
+def _rmse(y, y_pred):
+    return float(np.sqrt(np.mean((y - y_pred) ** 2)))
+
+
+def _evaluate(estimator, params, cached_folds, n_rows, rng_seed):
+    # Cross-validates one candidate, using the first n_rows of a (fixed)
+    # random order of each fold's training data.
+    scores, fit_seconds = [], []
+    for fold, (X_train, y_train, X_test, y_test) in enumerate(cached_folds):
+        rows = np.random.default_rng(rng_seed + fold).permutation(len(y_train))[:n_rows]
+        model = clone(estimator).set_params(**params)
+        start = time.perf_counter()
+        model.fit(X_train[rows], y_train[rows])
+        fit_seconds.append(time.perf_counter() - start)
+        scores.append(_rmse(y_test, model.predict(X_test)))
+    return scores, fit_seconds
+
+
+def _halving_rounds(n_candidates, n_rows, factor, min_resources):
+    # The number of training rows used in each round. The last round uses all
+    # of the rows, and each earlier round uses factor times fewer, but no
+    # fewer than min_resources. There is always at least one round.
+    n_rounds = 1 + math.ceil(math.log(max(n_candidates, 1), factor))
+    n_rounds = min(n_rounds, 1 + int(math.log(max(n_rows / min_resources, 1), factor)))
+    n_rounds = max(n_rounds, 1)
+    return [n_rows // factor ** (n_rounds - 1 - i) for i in range(n_rounds)]
+
+
+def search_family(dataset_name, dat, family_name, family, cv=5, halving=False, factor=3,
+                  min_resources=50, seed=0):
+    """
+    Tunes one model on one dataset.
+
+    Returns a list of dictionaries, one per candidate (and per round, with
+    successive halving), with the mean and standard deviation of the
+    cross-validation RMSE and the time taken to fit the candidate. The last
+    round (marked 'final_round') always uses all of the training rows, so its
+    RMSEs can be compared between models; with successive halving, once one
+    candidate is left it goes straight to that round, as in sklearn's
+    ``HalvingGridSearchCV``.
+    """
+    train = dat.loc[dat.train_ind]
+    X, y = train[FEATURES].to_numpy(dtype=float), train['pmts'].to_numpy(dtype=float)
+    if isinstance(cv, int):
+        cv = KFold(n_splits=cv)  # The default folds of GridSearchCV
+    cached_folds = _preprocess_folds(X, y, list(cv.split(X, y)), family['transformer'])
+
+    candidates = _candidates(family, seed)
+    n_rows = min(len(fold[1]) for fold in cached_folds)
+    rounds = (_halving_rounds(len(candidates), n_rows, factor, min_resources)
+              if halving else [n_rows])
+
+    results = []
+    round_number = 0
+    while True:
+        final = round_number == len(rounds) - 1 or len(candidates) == 1
+        round_rows = n_rows if final else rounds[round_number]
+        round_results = []
+        for params in candidates:
+            scores, fit_seconds = _evaluate(family['estimator'], params, cached_folds,
+                                            round_rows, seed)
+            round_results.append({'dataset': dataset_name,
+                                  'model': family_name,
+                                  'params': json.dumps(params, default=str),
+                                  'round': round_number,
+                                  'final_round': final,
+                                  'n_train_rows': round_rows,
+                                  'cv_rmse': np.mean(scores),
+                                  'cv_rmse_std': np.std(scores),
+                                  'fit_seconds': np.sum(fit_seconds),
+                                  'mean_fit_seconds': np.mean(fit_seconds)})
+        results += round_results
+
+        order = np.argsort([r['cv_rmse'] for r in round_results], kind='stable')
+        if final:
+            break
+        # Keep the best 1/factor of the candidates for the next round.
+        n_keep = max(1, math.ceil(len(candidates) / factor))
+        candidates = [candidates[i] for i in order[:n_keep]]
+        round_number += 1
+
+    # Refit the best candidate of the final round on all of the past data,
+    # and score it on the future data.
+    best = round_results[order[0]]
+    model = clone(family['estimator']).set_params(**candidates[order[0]])
+    if family['transformer'] is not None:
+        model = Pipeline([('transform', clone(family['transformer'])), ('model', model)])
+    model.fit(X, y)
+    future = dat.loc[~dat.train_ind]
+    best['test_rmse'] = _rmse(future['pmts'].to_numpy(dtype=float),
+                              model.predict(future[FEATURES].to_numpy(dtype=float)))
+    best['best'] = True
+    return results
+
+
+def _search_family_args(args):
+    return search_family(*args)
+
+
+# The thread limits of a worker process, kept for the life of the process.
+_thread_limits = None
+
+
+def _init_worker():
+    # Each worker fits one model at a time, so HistGradientBoosting (OpenMP)
+    # and the neural network (BLAS) are limited to one thread each. Otherwise
+    # every worker starts a thread per core, and the cores are oversubscribed.
+    from threadpoolctl import threadpool_limits
+
+    global _thread_limits
+    _thread_limits = threadpool_limits(1)
+
+
+def run_comparison(datasets, families=None, n_jobs=None, cv=5, halving=False, factor=3,
+                   min_resources=50, seed=0, output=None):
+    """
+    Tunes every model family on every dataset.
+
+    datasets is a dictionary of {name: DataFrame}, e.g.
+    ``{n: load_dataset(n) for n in range(1, 5)}``, and families a dictionary
+    in the same form as MODEL_FAMILIES (the default).
+
+    Each (dataset, model) search runs as one task on n_jobs processes (all
+    cores by default, each using one thread; n_jobs=1 runs them in the
+    current process). The leaderboard has the candidates of the final round
+    of each search, which are all fitted on all of the training rows. It is
+    returned sorted by dataset and future (test) RMSE, and saved to output
+    (a CSV file) if given.
+    """
+    if families is None:
+        families = MODEL_FAMILIES
+    tasks = [(dataset_name, dat, family_name, family, cv, halving, factor, min_resources, seed)
+             for dataset_name, dat in datasets.items()
+             for family_name, family in families.items()]
+
+    if n_jobs is None:
+        n_jobs = os.cpu_count() or 1
+    start = time.perf_counter()
+    if n_jobs == 1:
+        results = [_search_family_args(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker) as executor:
+            results = list(executor.map(_search_family_args, tasks))
+    print(f'Tuned {len(tasks)} models in {time.perf_counter() - start:0.1f} seconds')
+
+    leaderboard = pd.DataFrame([r for family_results in results for r in family_results
+                                if r['final_round']])
+    leaderboard['best'] = leaderboard['best'].notna()
+    leaderboard = leaderboard.sort_values(['dataset', 'best', 'test_rmse', 'cv_rmse'],
+                                          ascending=[True, False, True, True])
+    if output is not None:
+        leaderboard.to_csv(output, index=False)
+    return leaderboard.reset_index(drop=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Tune and compare the reserving models.')
+    parser.add_argument('--datasets', nargs='+', default=['1', '2', '3', '4'],
+                        help='1 to 4 for the simulated datasets, or CSV / Parquet files')
+    parser.add_argument('--output', default='model_leaderboard.csv')
+    parser.add_argument('--n-jobs', type=int, default=None)
+    parser.add_argument('--halving', action='store_true',
+                        help='use successive halving to drop poor candidates early')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    datasets = {str(source): load_dataset(source) for source in args.datasets}
+    leaderboard = run_comparison(datasets, n_jobs=args.n_jobs, halving=args.halving,
+                                 seed=args.seed, output=args.output)
+    print(leaderboard.loc[leaderboard['best'],
+                          ['dataset', 'model', 'cv_rmse', 'test_rmse', 'fit_seconds']]
+          .to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,244 @@
+"""
+Building a PCA index from data too large to load at once.
+
+Used by the *Py: Socio-Economic Index Construction* notebook
+(SEIFA_IER_index_2021_replicate.ipynb).
+
+The notebook loads a cut of the SA1 data into memory, standardises it with
+``StandardScaler`` and fits ``PCA()`` to all of it. ``StreamingIndex`` builds
+the same index from files of any size (e.g. all SA1s or mesh blocks):
+- the data is read in chunks, and the means, standard deviations and
+  correlation matrix of the variables are all accumulated in a single pass;
+- the principal components are the eigenvectors of the correlation matrix,
+  which only has one row and column per variable, so the result is the same
+  as ``PCA`` on the standardised data (``method='incremental'`` instead fits
+  ``IncrementalPCA`` in a second pass, for data with very many variables);
+- the areas are scored, and the scores standardised to a mean of 1,000 and
+  standard deviation of 100, in one more pass that writes the scores to a
+  file chunk by chunk; and
+- the means, standard deviations and loadings are saved to a small JSON file,
+  so new data (e.g. a later census, or the same variables for other areas)
+  can be scored against them without refitting.
+"""
+
+import json
+
+import numpy as np
+import pandas as pd
+
+# The variables the ABS uses for the IER (per their methodology)
+IER_VARIABLES = ['INC_LOW', 'LOWRENT', 'NOCAR', 'LONE', 'ONEPARENT', 'OVERCROWD',
+                 'UNEMPLOYED_IER', 'GROUP', 'OWNING', 'UNINCORP', 'INC_HIGH',
+                 'HIGHMORTGAGE', 'MORTGAGE', 'HIGHBED']
+
+
+def read_chunks(path, columns, chunksize=100000):
+    """Reads the columns of a CSV or Parquet file in chunks of rows."""
+    if str(path).lower().endswith('.parquet'):
+        import pyarrow.parquet
+
+        parquet_file = pyarrow.parquet.ParquetFile(path)
+        for batch in parquet_file.iter_batches(batch_size=chunksize, columns=columns):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, usecols=columns, chunksize=chunksize)
+
+
+class StreamingIndex:
+    """
+    A socio-economic index from the first principal component of
+    standardised variables, fitted and scored in chunks.
+
+    The sign of the first component is chosen so that sign_variable has a
+    positive loading (e.g. a higher share of high incomes gives a higher
+    IER), which is the same as reversing the sign in the notebook.
+    """
+
+    def __init__(self, variables=IER_VARIABLES, id_column='SA1_2021', sign_variable='INC_HIGH'):
+        self.variables = list(variables)
+        self.id_column = id_column
+        self.sign_variable = sign_variable
+        self._reset()
+
+    def _reset(self):
+        self.n = 0
+        self._mean = np.zeros(len(self.variables))
+        self._cross_products = np.zeros((len(self.variables), len(self.variables)))
+
+    def _values(self, chunk):
+        # Rows with missing values are dropped, as in the notebook.
+        chunk = chunk.dropna(subset=self.variables)
+        return chunk, chunk[self.variables].to_numpy(dtype=float)
+
+    def partial_fit(self, chunk):
+        """
+        Adds a chunk of rows to the means and the matrix of cross products
+        about the mean.
+
+        The chunk's own statistics are combined with the running totals
+        (Chan et al.'s method), which is more accurate than summing squares
+        when the values are large.
+        """
+        _, X = self._values(chunk)
+        n_chunk = len(X)
+        if n_chunk == 0:
+            return self
+        mean_chunk = X.mean(axis=0)
+        centred = X - mean_chunk
+        delta = mean_chunk - self._mean
+        n_total = self.n + n_chunk
+        self._cross_products += (centred.T @ centred
+                                 + np.outer(delta, delta) * self.n * n_chunk / n_total)
+        self._mean += delta * n_chunk / n_total
+        self.n = n_total
+        return self
+
+    def _finish(self):
+        # Standardising divides by the standard deviations (with ddof=0, as
+        # StandardScaler does), so the covariance of the standardised data is
+        # the correlation matrix.
+        covariance = self._cross_products / self.n
+        self.mean_ = self._mean.copy()
+        self.scale_ = np.sqrt(np.diag(covariance))
+        correlation = covariance / np.outer(self.scale_, self.scale_)
+
+        eigenvalues, eigenvectors = np.linalg.eigh(correlation)
+        order = np.argsort(eigenvalues)[::-1]
+        self.explained_variance_ = eigenvalues[order]
+        self.components_ = eigenvectors[:, order].T
+        self._orient()
+
+    def _orient(self):
+        self.explained_variance_ratio_ = self.explained_variance_ / self.explained_variance_.sum()
+        if self.components_[0, self.variables.index(self.sign_variable)] < 0:
+            self.components_[0] *= -1
+        # The scores have mean zero and variance equal to the eigenvalue, so
+        # the final standardisation is known without another pass. pandas'
+        # std() (used in the notebook) divides by n - 1.
+        self.score_std_ = np.sqrt(self.explained_variance_[0] * self.n / (self.n - 1))
+
+    def fit(self, chunks):
+        """
+        Fits the index to an iterable of DataFrame chunks, in one pass.
+
+        Any data the index was fitted to before is forgotten; use
+        ``partial_fit`` to add data to it instead.
+        """
+        self._reset()
+        for chunk in chunks:
+            self.partial_fit(chunk)
+        self._finish()
+        return self
+
+    def fit_file(self, path, chunksize=100000, method='covariance'):
+        """
+        Fits the index to a CSV or Parquet file, reading chunksize rows at a time.
+
+        method='covariance' (the default) needs one pass of the file and
+        gives the same components as ``PCA``. method='incremental' uses the
+        first pass only for the means and standard deviations, and fits
+        ``IncrementalPCA`` to the standardised chunks in a second pass.
+        """
+        self.fit(read_chunks(path, self.variables, chunksize))
+        if method == 'incremental':
+            from sklearn.decomposition import IncrementalPCA
+
+            incremental = IncrementalPCA()
+            # IncrementalPCA needs at least as many rows as variables in each
+            # batch, so a short chunk (usually the last) is joined to the one
+            # before it rather than left out.
+            batch = None
+            for chunk in read_chunks(path, self.variables, chunksize):
+                _, X = self._values(chunk)
+                X = (X - self.mean_) / self.scale_
+                if batch is None:
+                    batch = X
+                elif len(batch) < len(self.variables) or len(X) < len(self.variables):
+                    batch = np.vstack([batch, X])
+                else:
+                    incremental.partial_fit(batch)
+                    batch = X
+            if batch is not None:
+                incremental.partial_fit(batch)
+            self.components_ = incremental.components_
+            self.explained_variance_ = incremental.explained_variance_ * (self.n - 1) / self.n
+            self._orient()
+        elif method != 'covariance':
+            raise ValueError(f"method must be 'covariance' or 'incremental', not '{method}'")
+        return self
+
+    def transform(self, chunk):
+        """The principal component scores of a chunk (after dropping missing values)."""
+        _, X = self._values(chunk)
+        return ((X - self.mean_) / self.scale_) @ self.components_.T
+
+    def score(self, chunk, name='index'):
+        """
+        Scores a chunk of areas: returns a DataFrame of the area id, the raw
+        score (first principal component) and the index, with a mean of 1,000
+        and standard deviation of 100 over the data the index was fitted to.
+        """
+        chunk, X = self._values(chunk)
+        raw = ((X - self.mean_) / self.scale_) @ self.components_[0]
+        return pd.DataFrame({self.id_column: chunk[self.id_column].to_numpy(),
+                             'raw_score': raw,
+                             name: raw / self.score_std_ * 100 + 1000})
+
+    def score_file(self, path, output, chunksize=100000, name='index'):
+        """
+        Scores every area in a CSV or Parquet file, writing the scores to
+        output (CSV, or Parquet if the name ends in .parquet) chunk by chunk.
+        """
+        columns = [self.id_column] + self.variables
+        writer = None
+        try:
+            for n_chunk, chunk in enumerate(read_chunks(path, columns, chunksize)):
+                scores = self.score(chunk, name)
+                if str(output).lower().endswith('.parquet'):
+                    import pyarrow
+                    import pyarrow.parquet
+
+                    table = pyarrow.Table.from_pandas(scores, preserve_index=False)
+                    if writer is None:
+                        writer = pyarrow.parquet.ParquetWriter(output, table.schema)
+                    writer.write_table(table)
+                else:
+                    scores.to_csv(output, mode='w' if n_chunk == 0 else 'a',
+                                  header=n_chunk == 0, index=False)
+        finally:
+            if writer is not None:
+                writer.close()
+        return output
+
+    def loadings(self):
+        """The first principal component loading of each variable."""
+        return pd.DataFrame({'Variable': self.variables, 'PC1 Loading': self.components_[0]})
+
+    def save(self, path):
+        """Saves the fitted means, standard deviations and loadings to a JSON file."""
+        with open(path, 'w') as f:
+            json.dump({'variables': self.variables,
+                       'id_column': self.id_column,
+                       'sign_variable': self.sign_variable,
+                       'n': self.n,
+                       'mean': self.mean_.tolist(),
+                       'scale': self.scale_.tolist(),
+                       'components': self.components_.tolist(),
+                       'explained_variance': self.explained_variance_.tolist(),
+                       'score_std': self.score_std_}, f, indent=1)
+
+    @classmethod
+    def load(cls, path):
+        """Loads an index saved by ``save``, ready to score new data."""
+        with open(path) as f:
+            saved = json.load(f)
+        index = cls(saved['variables'], saved['id_column'], saved['sign_variable'])
+        index.n = saved['n']
+        index.mean_ = np.array(saved['mean'])
+        index.scale_ = np.array(saved['scale'])
+        index.components_ = np.array(saved['components'])
+        index.explained_variance_ = np.array(saved['explained_variance'])
+        index.explained_variance_ratio_ = (index.explained_variance_
+                                           / index.explained_variance_.sum())
+        index.score_std_ = saved['score_std']
+        return index
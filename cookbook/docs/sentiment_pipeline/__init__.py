@@ -0,0 +1,46 @@
+'''
+Helper functions for the *Py: Customer Sentiment Analysis* notebook (DAA_M07_CS2).
+
+The notebook walks through each step of the analysis on the 19,395 travel
+insurance reviews. The functions in this package are used when the same steps
+need to be run on much larger corpora, where running the notebook cells as-is
+would take too long.
+
+Each step is in its own module, and a module is only imported when one of its
+functions is first used (e.g. ``from sentiment_pipeline import clean_column``
+does not import scikit-learn). The heavy packages (nltk, scikit-learn,
+sentence-transformers, wordcloud) are only imported by the functions that need
+them, so a worker process or script that only cleans text starts quickly.
+'''
+
+import importlib
+
+# The module each function is defined in, imported when first used.
+_EXPORTS = {
+    'SpellingTable': 'spelling', 'build_vocabulary': 'spelling', 'tokenise': 'spelling',
+    'TextCleaner': 'cleaning', 'clean_column': 'cleaning', 'cleaning_pool': 'cleaning',
+    'ensure_nltk_data': 'cleaning', 'load_sym_spell': 'cleaning',
+    'read_reviews': 'ingest', 'read_tfidf': 'ingest', 'stream_reviews': 'ingest',
+    'EmbeddingStore': 'embeddings',
+    'benchmark_reduction': 'reduction', 'embed_2d': 'reduction',
+    'reduce_dimensions': 'reduction',
+    'fit_clusters': 'clustering', 'sweep_k': 'clustering',
+    'cluster_term_frequencies': 'topics', 'plot_wordcloud': 'topics', 'top_terms': 'topics',
+    'check_import_time': 'startup', 'import_time': 'startup',
+    'MemorySampler': 'profiling', 'RunProfiler': 'profiling', 'load_history': 'profiling',
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module 'sentiment_pipeline' has no attribute '{name}'")
+    value = getattr(importlib.import_module('sentiment_pipeline.' + _EXPORTS[name]), name)
+    # Save it in the package, so later uses do not come back here.
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
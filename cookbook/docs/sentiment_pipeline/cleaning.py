@@ -0,0 +1,205 @@
+'''
+Batch cleaning of a whole column of reviews.
+
+Running ``dataset['body'].apply(clean_text)`` cleans one review at a time on a
+single core, and it is run twice: once for the full clean and once for the
+basic clean used by BERT. ``clean_column`` instead:
+- splits the reviews into chunks and cleans the chunks in parallel over a pool
+  of processes;
+- loads the SymSpell dictionary, stopwords, stemmer and lemmatiser once in each
+  process, rather than once per review;
+- produces both the full and basic clean of each review in one pass; and
+- only imports nltk and loads the dictionary when a ``TextCleaner`` is first
+  created, so importing this module is quick. With ``sym_spell_index`` the
+  dictionary is memory-mapped from a saved index (see ``symspell_index``)
+  rather than rebuilt.
+'''
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+from sentiment_pipeline.spelling import SpellingTable, tokenise
+
+# Words that are likely to be found in the case study corpus, added to the
+# dictionary to avoid them being incorrectly 'fixed' by the spell checker.
+EXTRA_WORDS = {'covid': 5, 'coronavirus': 5}
+
+
+# The nltk data used to clean the text: (resource path, package to download)
+NLTK_DATA = [('corpora/stopwords', 'stopwords'), ('corpora/wordnet', 'wordnet')]
+
+
+def ensure_nltk_data():
+    ''' Downloads the nltk stopwords and wordnet, unless they are already
+        installed.
+
+        ``nltk.download`` asks the nltk server for its index on every call,
+        even if the data is already installed, so it is only called for data
+        that cannot be found.
+    '''
+    import nltk
+
+    for resource, package in NLTK_DATA:
+        # find also looks inside zipped data (e.g. corpora/wordnet.zip).
+        try:
+            nltk.data.find(resource)
+        except LookupError:
+            nltk.download(package, quiet=True)
+
+
+def dictionary_path():
+    ''' The path of the English frequency dictionary that comes with symspellpy.'''
+    from importlib.resources import files
+
+    return str(files('symspellpy') / 'frequency_dictionary_en_82_765.txt')
+
+
+def load_sym_spell(max_edit_distance=3, prefix_length=7, extra_words=EXTRA_WORDS,
+                   index_dir=None):
+    ''' Loads the SymSpell dictionary with the settings used in the notebook.
+
+        If index_dir is given, the dictionary is memory-mapped from the index
+        saved in that folder. If there is no index there yet (or it was built
+        with different settings), the dictionary is built and saved to the
+        folder, so later calls (and other processes) can load it quickly.
+    '''
+    from symspellpy import SymSpell
+
+    from sentiment_pipeline.symspell_index import load_index, save_index
+
+    settings = {'extra_words': extra_words}
+    if index_dir is not None:
+        sym_spell = load_index(index_dir, max_edit_distance, prefix_length, settings)
+        if sym_spell is not None:
+            return sym_spell
+
+    sym_spell = SymSpell(max_dictionary_edit_distance=max_edit_distance,
+                         prefix_length=prefix_length)
+    sym_spell.load_dictionary(dictionary_path(), term_index=0, count_index=1)
+    for word, count in extra_words.items():
+        sym_spell.create_dictionary_entry(word, count)
+    if index_dir is not None:
+        save_index(sym_spell, index_dir, settings)
+    return sym_spell
+
+
+class TextCleaner:
+    ''' Holds everything needed to clean text, so that it is only loaded once.
+
+        ``clean`` returns the same results as ``clean_text`` in the notebook,
+        with full_clean=1 and full_clean=0 respectively.
+    '''
+
+    def __init__(self, spelling_table_path=None, max_edit_distance=3, sym_spell_index=None):
+        import nltk
+
+        ensure_nltk_data()
+        sym_spell = load_sym_spell(max_edit_distance, index_dir=sym_spell_index)
+        if spelling_table_path is not None:
+            self.spelling_table = SpellingTable.load(
+                spelling_table_path, sym_spell, max_edit_distance)
+        else:
+            self.spelling_table = SpellingTable(sym_spell, max_edit_distance)
+
+        self.stopwords = set(nltk.corpus.stopwords.words('english'))
+        self.stemmer = nltk.stem.porter.PorterStemmer()
+        self.lemmatiser = nltk.stem.wordnet.WordNetLemmatizer()
+
+        # Stemming and lemmatisation only depend on the word, so remember the
+        # result for each word rather than recalculating it every time.
+        self.stem_and_lemmatise = lru_cache(maxsize=200000)(self._stem_and_lemmatise)
+
+    def _stem_and_lemmatise(self, word):
+        return self.lemmatiser.lemmatize(self.stemmer.stem(word))
+
+    def clean(self, text):
+        ''' Returns the (full clean, basic clean) of a single text.'''
+        text_list = self.spelling_table.correct(tokenise(text))
+        basic = ' '.join(text_list)
+        full = ' '.join(self.stem_and_lemmatise(word) for word in text_list
+                        if word not in self.stopwords)
+        return full, basic
+
+    def clean_texts(self, texts):
+        ''' Returns lists of the full and basic clean of each text.'''
+        full_list = []
+        basic_list = []
+        for text in texts:
+            full, basic = self.clean(text)
+            full_list.append(full)
+            basic_list.append(basic)
+        return full_list, basic_list
+
+
+# Each worker process keeps its own TextCleaner, created once when the worker
+# starts.
+_worker_cleaner = None
+
+
+def _init_worker(spelling_table_path, max_edit_distance, sym_spell_index):
+    global _worker_cleaner
+    _worker_cleaner = TextCleaner(spelling_table_path, max_edit_distance, sym_spell_index)
+
+
+def _clean_chunk(texts):
+    return _worker_cleaner.clean_texts(texts)
+
+
+def cleaning_pool(n_jobs=None, spelling_table_path=None, max_edit_distance=3,
+                  sym_spell_index=None):
+    ''' Creates a pool of processes that each hold a TextCleaner.
+
+        The pool can be passed to ``clean_column`` to clean several columns (or
+        chunks of a file) without loading the dictionaries again each time.
+    '''
+    if sym_spell_index is not None:
+        # Build the index once here, rather than in every worker at once.
+        load_sym_spell(max_edit_distance, index_dir=sym_spell_index)
+    return ProcessPoolExecutor(max_workers=n_jobs or os.cpu_count() or 1,
+                               initializer=_init_worker,
+                               initargs=(spelling_table_path, max_edit_distance,
+                                         sym_spell_index))
+
+
+def clean_column(texts, n_jobs=None, chunk_size=5000, spelling_table_path=None,
+                 max_edit_distance=3, pool=None, sym_spell_index=None):
+    ''' Cleans a whole column of texts (e.g. ``dataset['body']``).
+
+        Returns two lists, the full clean and the basic clean of each text, in
+        the same order as the input.
+
+        n_jobs is the number of processes to use (all cores by default). With
+        n_jobs=1 the texts are cleaned in the current process.
+
+        If spelling_table_path is given, each process starts from the spelling
+        corrections saved in that file (see ``SpellingTable.save``). If
+        sym_spell_index is given, each process memory-maps the SymSpell
+        dictionary from the index in that folder (see ``load_sym_spell``).
+
+        If a pool created with ``cleaning_pool`` is given, it is used instead
+        of starting new processes, and the other settings are ignored.
+    '''
+    texts = list(texts)
+    if n_jobs is None:
+        n_jobs = os.cpu_count() or 1
+
+    if pool is None and n_jobs == 1:
+        cleaner = TextCleaner(spelling_table_path, max_edit_distance, sym_spell_index)
+        return cleaner.clean_texts(texts)
+
+    chunks = [texts[i:i + chunk_size] for i in range(0, len(texts), chunk_size)]
+    full_list = []
+    basic_list = []
+    if pool is None:
+        with cleaning_pool(n_jobs, spelling_table_path, max_edit_distance,
+                           sym_spell_index) as executor:
+            results = list(executor.map(_clean_chunk, chunks))
+    else:
+        results = pool.map(_clean_chunk, chunks)
+
+    # 'map' returns the results in the same order as the chunks.
+    for full, basic in results:
+        full_list.extend(full)
+        basic_list.extend(basic)
+    return full_list, basic_list
@@ -0,0 +1,64 @@
+'''
+Choosing the number of clusters.
+
+The notebook fixes the number of clusters at K = 6 and scores the clustering
+with ``silhouette_score``, which compares every review with every other review.
+Both the time and memory this takes grow with the square of the number of
+reviews, so it is not practical for large datasets.
+
+``sweep_k`` instead fits a ``MiniBatchKMeans`` model for each K in a range, in
+parallel and on the same (reduced) embeddings, and reports for each K:
+- the WCSS (within-cluster sum of squares, smaller is better);
+- the silhouette score estimated on a random sample of the reviews (closer to 1
+  is better); and
+- the Calinski-Harabasz score, the ratio of the spread between clusters to
+  the spread within clusters (larger is better), which is fast to calculate on
+  all of the reviews.
+'''
+
+import time
+
+import pandas as pd
+
+
+def fit_clusters(X, k, batch_size=4096, random_state=0):
+    ''' Fits a MiniBatchKMeans model with k clusters to X.'''
+    from sklearn.cluster import MiniBatchKMeans
+
+    model = MiniBatchKMeans(n_clusters=k, batch_size=batch_size, n_init=3,
+                            random_state=random_state)
+    return model.fit(X)
+
+
+def _score_k(X, k, batch_size, silhouette_sample_size, random_state):
+    from sklearn.metrics import calinski_harabasz_score, silhouette_score
+
+    start = time.perf_counter()
+    model = fit_clusters(X, k, batch_size, random_state)
+    labels = model.labels_
+    sample_size = min(silhouette_sample_size, X.shape[0])
+    return {'k': k,
+            'wcss': model.inertia_,
+            'silhouette_sampled': silhouette_score(X, labels, sample_size=sample_size,
+                                                   random_state=random_state),
+            'calinski_harabasz': calinski_harabasz_score(X, labels),
+            'seconds': time.perf_counter() - start}
+
+
+def sweep_k(X, k_values=range(2, 16), batch_size=4096, silhouette_sample_size=10000,
+            n_jobs=-1, random_state=0):
+    ''' Fits and scores a clustering for each K in k_values.
+
+        X should be the reduced embeddings (see ``reduce_dimensions``). The
+        values of K are run in parallel on n_jobs processes (all cores by
+        default); joblib shares X between the processes rather than copying it
+        for each K.
+
+        Returns a DataFrame with one row per K.
+    '''
+    from joblib import Parallel, delayed
+
+    results = Parallel(n_jobs=n_jobs)(
+        delayed(_score_k)(X, k, batch_size, silhouette_sample_size, random_state)
+        for k in k_values)
+    return pd.DataFrame(results).set_index('k')
@@ -0,0 +1,151 @@
+'''
+An on-disk store of sentence embeddings.
+
+Encoding the reviews with BERT is the slowest step of the notebook, and every
+time the notebook is run all of the reviews are encoded again, even though most
+of them have not changed. ``EmbeddingStore`` keeps the embeddings of each review
+on disk, keyed by a hash of the review text, so that only new or changed reviews
+need to be encoded.
+
+The embeddings are stored as one large float32 array that is memory-mapped
+(``np.memmap``), so reading them back does not need to load the whole file into
+memory.
+'''
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+
+def text_hash(text):
+    ''' A short hash of the text, used to look up its embedding.'''
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+
+
+class EmbeddingStore:
+    ''' Embeddings for one SentenceTransformer model, stored in a folder.
+
+        The folder contains:
+        - meta.json: the model name and the size of each embedding;
+        - vectors.f32: the embeddings, one row per text, as float32; and
+        - keys.txt: the hash of the text for each row, in the same order.
+
+        model can be an already loaded SentenceTransformer. If it is not given,
+        the model is only loaded when there are texts that need encoding.
+    '''
+
+    def __init__(self, directory, model_name, model=None):
+        # Each model gets its own folder, as embeddings from different models
+        # cannot be mixed.
+        self.directory = os.path.join(directory, model_name.replace('/', '__'))
+        self.model_name = model_name
+        self.model = model
+        os.makedirs(self.directory, exist_ok=True)
+
+        self.meta_path = os.path.join(self.directory, 'meta.json')
+        self.vectors_path = os.path.join(self.directory, 'vectors.f32')
+        self.keys_path = os.path.join(self.directory, 'keys.txt')
+
+        self.dim = None
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path) as f:
+                self.dim = json.load(f)['dim']
+
+        self.rows = {}
+        if os.path.exists(self.keys_path):
+            with open(self.keys_path) as f:
+                keys = f.read().split()
+            # The vectors are written before the keys, so if a run was stopped
+            # part way through there can be vectors without keys but not the
+            # other way around.
+            for row, key in enumerate(keys[:self._n_vectors()]):
+                self.rows[key] = row
+
+    def __len__(self):
+        return len(self.rows)
+
+    def _n_vectors(self):
+        if self.dim is None or not os.path.exists(self.vectors_path):
+            return 0
+        return os.path.getsize(self.vectors_path) // (4 * self.dim)
+
+    def _vectors(self):
+        return np.memmap(self.vectors_path, dtype=np.float32, mode='r',
+                         shape=(len(self.rows), self.dim))
+
+    def _append(self, keys, vectors):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+            with open(self.meta_path, 'w') as f:
+                json.dump({'model_name': self.model_name, 'dim': self.dim}, f)
+
+        # Remove any vectors left over from a run that was stopped part way,
+        # so that the rows and keys line up.
+        with open(self.vectors_path, 'ab') as f:
+            f.truncate(len(self.rows) * 4 * self.dim)
+            f.write(vectors.tobytes())
+        with open(self.keys_path, 'a') as f:
+            f.write(''.join(key + '\n' for key in keys))
+
+        for key in keys:
+            self.rows[key] = len(self.rows)
+
+    def _load_model(self):
+        if self.model is None:
+            from sentence_transformers import SentenceTransformer
+            self.model = SentenceTransformer(self.model_name)
+        return self.model
+
+    def encode(self, texts, batch_size=64, flush_size=10000, show_progress=True):
+        ''' Returns the embeddings of the texts, encoding any that are not in
+            the store yet.
+
+            The texts that need encoding are encoded in blocks of flush_size
+            texts, and each block is saved as soon as it is done, so a run that
+            is stopped part way does not lose all of its work. Within a block,
+            ``SentenceTransformer.encode`` sorts the texts by length, so that
+            each batch of batch_size holds texts of similar length and little
+            time is spent on padding.
+
+            New texts are stored in the order they first appear in texts. So if
+            the texts (without repeats) are in the same order as when they were
+            first stored, e.g. when the notebook is run again on the same
+            reviews, the result is a read-only view of the memory-mapped file
+            rather than a copy.
+        '''
+        keys = [text_hash(text) for text in texts]
+
+        # Find the distinct texts that have not been encoded yet.
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in self.rows and key not in missing:
+                missing[key] = text
+
+        if missing:
+            model = self._load_model()
+            missing_keys = list(missing)
+            if show_progress:
+                print('Encoding {} new texts ({} already in the store) ...'.format(
+                    len(missing_keys), len(set(keys)) - len(missing_keys)))
+
+            for start in range(0, len(missing_keys), flush_size):
+                block = missing_keys[start:start + flush_size]
+                vectors = model.encode([missing[key] for key in block],
+                                       batch_size=batch_size,
+                                       show_progress_bar=False,
+                                       convert_to_numpy=True)
+                self._append(block, vectors)
+
+        if not keys:
+            return np.zeros((0, self.dim or 0), dtype=np.float32)
+
+        rows = np.fromiter((self.rows[key] for key in keys), dtype=np.int64,
+                           count=len(keys))
+        vectors = self._vectors()
+        first, last = rows[0], rows[-1] + 1
+        if last - first == len(rows) and np.all(np.diff(rows) == 1):
+            return vectors[first:last]
+        return vectors[rows]
@@ -0,0 +1,149 @@
+'''
+Streaming ingestion of reviews that are too large to fit in memory.
+
+The notebook reads the whole zipped csv into one DataFrame, adds two cleaned
+copies of the text and fits a ``TfidfVectorizer`` on all of the reviews at once.
+``stream_reviews`` instead reads the csv in chunks of a fixed number of rows
+and, for each chunk:
+- cleans the reviews (see ``clean_column``);
+- counts the terms in each review with a ``HashingVectorizer``, which does not
+  need to see the whole corpus first to build a vocabulary; and
+- writes the cleaned reviews to a Parquet file, and the term counts to a
+  sparse matrix file, in the output folder.
+
+Only one chunk is held in memory at a time, so the peak memory used depends on
+the chunk size rather than on the size of the input file.
+
+The inverse document frequencies (IDF) need the whole corpus, so the number of
+reviews containing each term is added up as the chunks go past and saved at the
+end. ``read_tfidf`` then applies the same IDF weighting and normalisation as
+``TfidfVectorizer`` when the term counts are read back.
+'''
+
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import scipy.sparse
+
+from sentiment_pipeline.cleaning import cleaning_pool, clean_column
+
+
+def read_reviews_in_chunks(path, chunksize=50000, encoding='cp1252', **kwargs):
+    ''' Reads a (possibly zipped) csv file of reviews in chunks of rows.
+
+        Any other arguments are passed on to ``pd.read_csv``.
+    '''
+    return pd.read_csv(path, encoding=encoding, chunksize=chunksize, **kwargs)
+
+
+def stream_reviews(path, output_dir, text_column='body', chunksize=50000,
+                   n_features=2**20, n_jobs=None, spelling_table_path=None,
+                   encoding='cp1252', sym_spell_index=None, **kwargs):
+    ''' Cleans and vectorises the reviews in a csv file, one chunk at a time.
+
+        The output folder will contain:
+        - reviews/part-00000.parquet, ...: the columns of the csv plus the
+          'body_clean_full' and 'body_clean_bert' columns;
+        - term_counts/part-00000.npz, ...: the hashed term counts of
+          'body_clean_full' for the reviews in the matching Parquet file;
+        - document_frequency.npy: the number of reviews containing each term; and
+        - summary.json: the number of reviews and chunks, and the settings used.
+
+        Any reviews and term counts already in the output folder (e.g. from an
+        earlier run) are deleted first.
+
+        Every chunk is written with the column types of the first chunk, so
+        that the Parquet files can be read back together. Columns that are
+        empty in the first chunk are stored as text. To set the column types
+        yourself, pass ``dtype`` (which, like any other arguments, is passed
+        on to ``pd.read_csv``).
+
+        spelling_table_path and sym_spell_index are passed on to ``cleaning_pool``.
+    '''
+    import pyarrow
+    import pyarrow.parquet
+    from sklearn.feature_extraction.text import HashingVectorizer
+
+    for folder in ('reviews', 'term_counts'):
+        shutil.rmtree(os.path.join(output_dir, folder), ignore_errors=True)
+        os.makedirs(os.path.join(output_dir, folder))
+
+    # norm=None and alternate_sign=False give the raw term counts, the same
+    # as the first step of TfidfVectorizer.
+    vectoriser = HashingVectorizer(n_features=n_features, alternate_sign=False,
+                                   norm=None)
+    document_frequency = np.zeros(n_features, dtype=np.int64)
+    n_reviews = 0
+    n_chunks = 0
+    schema = None
+
+    with cleaning_pool(n_jobs, spelling_table_path,
+                       sym_spell_index=sym_spell_index) as pool:
+        for chunk in read_reviews_in_chunks(path, chunksize, encoding, **kwargs):
+            # A missing review is cleaned as an empty string, rather than 'nan'.
+            full, basic = clean_column(chunk[text_column].fillna('').astype(str), pool=pool)
+            chunk['body_clean_full'] = full
+            chunk['body_clean_bert'] = basic
+
+            term_counts = vectoriser.transform(full).tocsr()
+            # Each non-zero entry in a column is a review that contains the term.
+            document_frequency += np.bincount(term_counts.indices,
+                                              minlength=n_features)
+
+            part = 'part-{:05d}'.format(n_chunks)
+            if schema is None:
+                schema = pyarrow.Schema.from_pandas(chunk, preserve_index=False)
+                for i, field in enumerate(schema):
+                    if chunk[field.name].isna().all():
+                        schema = schema.set(i, field.with_type(pyarrow.string()))
+            table = pyarrow.Table.from_pandas(chunk, schema=schema, preserve_index=False)
+            pyarrow.parquet.write_table(
+                table, os.path.join(output_dir, 'reviews', part + '.parquet'))
+            scipy.sparse.save_npz(os.path.join(output_dir, 'term_counts', part + '.npz'),
+                                  term_counts)
+
+            n_reviews += len(chunk)
+            n_chunks += 1
+            print('Processed {} reviews ...'.format(n_reviews))
+
+    np.save(os.path.join(output_dir, 'document_frequency.npy'), document_frequency)
+    summary = {'n_reviews': n_reviews, 'n_chunks': n_chunks,
+               'n_features': n_features, 'text_column': text_column}
+    with open(os.path.join(output_dir, 'summary.json'), 'w') as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
+
+def read_tfidf(output_dir, parts=None):
+    ''' Yields the TF-IDF weights of each chunk written by ``stream_reviews``.
+
+        This uses the same settings as the default ``TfidfVectorizer``: smoothed
+        inverse document frequencies and each review scaled to unit length.
+        Pass a list of chunk numbers as parts to only read some of the chunks.
+    '''
+    from sklearn.preprocessing import normalize
+
+    with open(os.path.join(output_dir, 'summary.json')) as f:
+        summary = json.load(f)
+    document_frequency = np.load(os.path.join(output_dir, 'document_frequency.npy'))
+    n = summary['n_reviews']
+    idf = np.log((1 + n) / (1 + document_frequency)) + 1
+
+    if parts is None:
+        parts = range(summary['n_chunks'])
+    for part in parts:
+        term_counts = scipy.sparse.load_npz(os.path.join(
+            output_dir, 'term_counts', 'part-{:05d}.npz'.format(part)))
+        yield normalize(term_counts.multiply(idf).tocsr())
+
+
+def read_reviews(output_dir, columns=None):
+    ''' Reads the cleaned reviews written by ``stream_reviews``.
+
+        Use columns to only read the columns that are needed, e.g.
+        ``read_reviews(output_dir, columns=['body_clean_bert'])``.
+    '''
+    return pd.read_parquet(os.path.join(output_dir, 'reviews'), columns=columns)
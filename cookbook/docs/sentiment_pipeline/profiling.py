@@ -0,0 +1,318 @@
+'''
+Recording the time and memory used by each stage of the pipeline.
+
+The notebook runs each step (cleaning, TF-IDF, t-SNE, BERT, KMeans, the
+silhouette scores and the word clouds) as top-level statements, using ``print``
+to show progress, so there is no record of how long each step took or how much
+memory it needed. ``RunProfiler`` records for each stage:
+- the wall time, and the CPU time of this process and of any worker processes
+  that finished during the stage (e.g. a ``clean_column`` pool);
+- the peak memory (resident set size) of this process and its worker
+  processes, sampled in a background thread while the stage runs;
+- the number of items processed (e.g. reviews) and the items per second; and
+- optionally a profile of the stage, from cProfile or the pyinstrument
+  sampling profiler, saved to a file with the slowest functions also kept in
+  the report.
+
+``save`` writes the results to a JSON run report, and can also add them to a
+history file with one line per run, so that runs can be compared with
+``load_history`` as the corpus grows.
+'''
+
+import json
+import os
+import platform
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+
+class MemorySampler:
+    ''' Samples the memory used by this process and its children in a thread.
+
+        Call ``start`` before the code and ``stop`` after it, which returns the
+        peak resident set size in MB (memory allocated outside Python, e.g. by
+        BLAS or numba compiled code, is included). ``baseline`` is the resident
+        set size in bytes when ``start`` was called, so the peak rise is
+        ``peak_mb - baseline / 2**20``.
+
+        Without psutil, the peak is the largest memory used by this process
+        since it started (from ``resource``), which is only an upper bound for
+        the stage, and ``baseline`` is None.
+    '''
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.peak = 0
+        self.baseline = None
+        self.thread = None
+        try:
+            import psutil
+        except ImportError:
+            self.psutil = None
+        else:
+            self.psutil = psutil
+            self.process = psutil.Process()
+            self.stopped = threading.Event()
+
+    def _rss(self):
+        # Memory shared between processes (e.g. a memory-mapped file) is
+        # counted once for each process that uses it.
+        total = self.process.memory_info().rss
+        for child in self.process.children(recursive=True):
+            try:
+                total += child.memory_info().rss
+            except self.psutil.Error:
+                pass  # The child finished after it was listed
+        return total
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.peak = max(self.peak, self._rss())
+
+    def start(self):
+        if self.psutil is not None:
+            self.peak = self.baseline = self._rss()
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        ''' Returns the peak memory in MB and how it was measured.'''
+        if self.thread is not None:
+            self.stopped.set()
+            self.thread.join()
+            self.peak = max(self.peak, self._rss())
+            return self.peak / 2**20, 'psutil'
+        try:
+            import resource
+        except ImportError:
+            return None, None  # Windows without psutil
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on macOS and KB on Linux.
+        return peak / (2**20 if platform.system() == 'Darwin' else 2**10), 'ru_maxrss'
+
+
+def _child_cpu():
+    # CPU time of child processes that have finished and been waited for.
+    # Workers that are kept running between stages (such as joblib's) are
+    # not included. Always zero on Windows.
+    times = os.times()
+    return times.children_user + times.children_system
+
+
+def _top_functions(profile, n):
+    import pstats
+
+    stats = pstats.Stats(profile).sort_stats('cumulative')
+    top = []
+    for function in stats.fcn_list[:n]:
+        _, n_calls, total, cumulative, _ = stats.stats[function]
+        top.append({'function': '{}:{}({})'.format(*function), 'calls': n_calls,
+                    'total_seconds': round(total, 4), 'cumulative_seconds': round(cumulative, 4)})
+    return top
+
+
+class RunProfiler:
+    ''' Records the time and memory used by each stage of a run.
+
+        Use ``stage`` as a context manager::
+
+            with profiler.stage('cleaning', n_items=len(dataset)):
+                ...
+
+        or call ``start`` and ``stop`` around the code (e.g. at the top and
+        bottom of a notebook cell).
+
+        profile can be 'cprofile' or 'pyinstrument' (``pip install
+        pyinstrument``) to profile every stage, or can be given for single
+        stages. Profiles are saved in profile_dir (the run name followed by
+        '_profiles' by default). Only this process is profiled, not workers.
+    '''
+
+    def __init__(self, name='run', profile=None, profile_dir=None, sample_interval=0.05,
+                 verbose=True):
+        self.name = name
+        self.profile = profile
+        self.profile_dir = profile_dir or name + '_profiles'
+        self.sample_interval = sample_interval
+        self.verbose = verbose
+        self.started_at = datetime.now().isoformat(timespec='seconds')
+        self.stages = []
+        self._current = None
+
+    def start(self, name, n_items=None, profile=None):
+        ''' Starts timing a stage. Returns the stage's record, a dictionary in
+            which n_items can be set once it is known.
+
+            Stages cannot overlap: a RuntimeError is raised if the previous
+            stage has not been stopped.
+        '''
+        if self._current is not None:
+            # E.g. a notebook cell failed between start and stop. Call
+            # stop(failed=True) to record the stage as failed and carry on.
+            raise RuntimeError("Stage '{}' is still running: call stop() before starting "
+                               "'{}'".format(self._current['record']['stage'], name))
+
+        profile = profile or self.profile
+        if profile not in (None, 'cprofile', 'pyinstrument'):
+            raise ValueError("profile must be None, 'cprofile' or 'pyinstrument'")
+        record = {'stage': name, 'n_items': None if n_items is None else int(n_items),
+                  'started_at': datetime.now().isoformat(timespec='seconds')}
+        profiler = None
+        if profile == 'cprofile':
+            import cProfile
+
+            profiler = cProfile.Profile()
+            profiler.enable()
+        elif profile == 'pyinstrument':
+            try:
+                from pyinstrument import Profiler
+            except ImportError:
+                raise ImportError("profile='pyinstrument' needs the pyinstrument package: "
+                                  "pip install pyinstrument")
+            profiler = Profiler()
+            profiler.start()
+
+        sampler = MemorySampler(self.sample_interval)
+        sampler.start()
+
+        self._current = {'record': record, 'sampler': sampler, 'profile': profile,
+                         'profiler': profiler, 'wall': time.perf_counter(),
+                         'cpu': time.process_time(), 'child_cpu': _child_cpu()}
+        return record
+
+    def stop(self, n_items=None, failed=False):
+        ''' Stops timing the current stage, and returns its record.'''
+        if self._current is None:
+            raise RuntimeError('No stage has been started')
+        current, self._current = self._current, None
+        wall = time.perf_counter() - current['wall']
+        cpu = time.process_time() - current['cpu']
+        child_cpu = _child_cpu() - current['child_cpu']
+        profiler = current['profiler']
+        if current['profile'] == 'cprofile':
+            profiler.disable()
+        elif current['profile'] == 'pyinstrument':
+            profiler.stop()
+        peak_mb, memory_source = current['sampler'].stop()
+
+        record = current['record']
+        if n_items is not None:
+            record['n_items'] = int(n_items)
+        record.update({
+            'status': 'failed' if failed else 'ok',
+            'wall_seconds': round(wall, 4),
+            'cpu_seconds': round(cpu, 4),
+            'child_cpu_seconds': round(child_cpu, 4),
+            'peak_memory_mb': None if peak_mb is None else round(peak_mb, 1),
+            'memory_source': memory_source,
+            'items_per_second': (round(record['n_items'] / wall, 2)
+                                 if record['n_items'] and wall > 0 else None),
+        })
+        if profiler is not None:
+            self._save_profile(record, current['profile'], profiler)
+        self.stages.append(record)
+        if self.verbose:
+            print(self._describe(record))
+        return record
+
+    @contextmanager
+    def stage(self, name, n_items=None, profile=None):
+        ''' Times the code in a ``with`` block as one stage.'''
+        record = self.start(name, n_items, profile)
+        failed = True
+        try:
+            yield record
+            failed = False
+        finally:
+            self.stop(failed=failed)
+
+    def _save_profile(self, record, profile, profiler):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        path = os.path.join(self.profile_dir, '{}_{}'.format(
+            record['stage'].replace(' ', '_'), len(self.stages)))
+        if profile == 'cprofile':
+            # Open with e.g. snakeviz, or pstats.Stats(path).print_stats()
+            path += '.prof'
+            profiler.dump_stats(path)
+            record['top_functions'] = _top_functions(profiler, 15)
+        else:
+            path += '.html'
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(profiler.output_html())
+        record['profile_path'] = path
+
+    @staticmethod
+    def _describe(record):
+        text = '{}: {:.2f}s'.format(record['stage'], record['wall_seconds'])
+        if record['items_per_second']:
+            text += ' for {:,} items ({:,.0f} per second)'.format(
+                record['n_items'], record['items_per_second'])
+        text += ', CPU {:.2f}s'.format(record['cpu_seconds'] + record['child_cpu_seconds'])
+        if record['peak_memory_mb'] is not None:
+            text += ', peak memory {:,.0f} MB'.format(record['peak_memory_mb'])
+        if record['status'] != 'ok':
+            text += ' (failed)'
+        return text
+
+    def report(self):
+        ''' The run report: details of the run and a record for each stage.'''
+        peaks = [stage['peak_memory_mb'] for stage in self.stages
+                 if stage['peak_memory_mb'] is not None]
+        return {'run': self.name,
+                'started_at': self.started_at,
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpu_count': os.cpu_count(),
+                'total_wall_seconds': round(sum(stage['wall_seconds']
+                                                for stage in self.stages), 4),
+                'peak_memory_mb': max(peaks) if peaks else None,
+                'stages': self.stages}
+
+    def save(self, path, history_path=None):
+        ''' Saves the run report to a JSON file.
+
+            If history_path is given, the report is also added as one line to
+            that file (see ``load_history``).
+        '''
+        report = self.report()
+        partial = path + '.partial'
+        with open(partial, 'w') as f:
+            json.dump(report, f, indent=1)
+        os.replace(partial, path)
+        if history_path is not None:
+            with open(history_path, 'a') as f:
+                f.write(json.dumps(report) + '\n')
+        return path
+
+    def summary(self):
+        ''' A DataFrame with one row per stage.'''
+        import pandas as pd
+
+        columns = ['stage', 'n_items', 'wall_seconds', 'cpu_seconds', 'child_cpu_seconds',
+                   'peak_memory_mb', 'items_per_second', 'status']
+        return pd.DataFrame(self.stages, columns=columns).set_index('stage')
+
+
+def load_history(path):
+    ''' Reads the run reports added to a history file by ``RunProfiler.save``.
+
+        Returns a DataFrame with one row per stage of each run, to compare
+        the runs, e.g. ``history.pivot_table(index='started_at',
+        columns='stage', values='wall_seconds')``.
+    '''
+    import pandas as pd
+
+    rows = []
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            report = json.loads(line)
+            for stage in report['stages']:
+                row = {key: value for key, value in stage.items()
+                       if key not in ('top_functions', 'started_at')}
+                rows.append(dict(row, run=report['run'], started_at=report['started_at'],
+                                 cpu_count=report['cpu_count']))
+    return pd.DataFrame(rows)
@@ -0,0 +1,161 @@
+'''
+Dimension reduction for clustering and plotting.
+
+The notebook used to reduce the TF-IDF weights and the BERT embeddings to two
+dimensions with t-SNE, and then cluster the two-dimensional points. t-SNE works
+well for plotting, but it becomes very slow for more than a few tens of
+thousands of reviews, and clustering the two-dimensional points throws away
+most of the information in the embeddings. Instead, the reduction is split into
+two steps:
+- ``reduce_dimensions`` uses TruncatedSVD (for the sparse TF-IDF weights) or
+  PCA (for the dense BERT embeddings) to reduce the embeddings to e.g. 50
+  dimensions. This is fast, and the clustering is run on these vectors; and
+- ``embed_2d`` reduces the 50-dimensional vectors to two dimensions for
+  plotting only, optionally on a random sample of the reviews. It uses
+  methods that only look for approximate nearest neighbours, which is what
+  makes them much faster than the exact t-SNE in scikit-learn.
+
+``benchmark_reduction`` compares the time and memory used by both approaches.
+'''
+
+import gc
+import time
+
+import numpy as np
+import scipy.sparse
+
+from sentiment_pipeline.profiling import MemorySampler
+
+
+def reduce_dimensions(X, n_components=50, random_state=0):
+    ''' Reduces X to n_components dimensions.
+
+        Sparse matrices (such as TF-IDF weights) are reduced with TruncatedSVD,
+        which works on the sparse matrix directly. Dense arrays (such as BERT
+        embeddings) are reduced with PCA.
+    '''
+    from sklearn.decomposition import PCA, TruncatedSVD
+
+    n_components = min(n_components, X.shape[1] - 1)
+    if scipy.sparse.issparse(X):
+        reducer = TruncatedSVD(n_components=n_components, random_state=random_state)
+    else:
+        reducer = PCA(n_components=n_components, svd_solver='randomized',
+                      random_state=random_state)
+    return reducer.fit_transform(X).astype(np.float32)
+
+
+def embed_2d(X, method='umap', sample_size=None, random_state=0):
+    ''' Reduces X to two dimensions, for plotting.
+
+        method can be:
+        - 'umap': UMAP, from the umap-learn package;
+        - 'opentsne': t-SNE from the openTSNE package, which uses approximate
+          nearest neighbours and an FFT-based approximation of the gradient; or
+        - 'tsne': the exact-neighbour t-SNE in scikit-learn, as in the notebook.
+
+        If sample_size is given, only a random sample of that many rows is
+        embedded. Returns the row numbers that were embedded and their
+        two-dimensional coordinates.
+    '''
+    rows = np.arange(X.shape[0])
+    if sample_size is not None and sample_size < X.shape[0]:
+        rng = np.random.default_rng(random_state)
+        rows = np.sort(rng.choice(X.shape[0], size=sample_size, replace=False))
+        X = X[rows]
+
+    if method == 'umap':
+        try:
+            import umap
+        except ImportError:
+            raise ImportError("method='umap' needs the umap-learn package: "
+                              "pip install umap-learn")
+        embedding = umap.UMAP(n_components=2, random_state=random_state).fit_transform(X)
+    elif method == 'opentsne':
+        try:
+            from openTSNE import TSNE as OpenTSNE
+        except ImportError:
+            raise ImportError("method='opentsne' needs the openTSNE package: "
+                              "pip install openTSNE")
+        embedding = np.asarray(OpenTSNE(n_components=2, neighbors='approx',
+                                        random_state=random_state, n_jobs=-1).fit(X))
+    elif method == 'tsne':
+        from sklearn.manifold import TSNE
+
+        embedding = TSNE(n_components=2, random_state=random_state).fit_transform(X)
+    else:
+        raise ValueError("method must be 'umap', 'opentsne' or 'tsne'")
+
+    return rows, embedding
+
+
+def _synthetic_tfidf(n, n_terms=20000, terms_per_review=30, seed=0):
+    # Random sparse weights with roughly the shape of the case study TF-IDF
+    # matrix, scaled so that each review has unit length.
+    rng = np.random.default_rng(seed)
+    X = scipy.sparse.random(n, n_terms, density=terms_per_review / n_terms,
+                            format='csr', dtype=np.float64, random_state=rng)
+    norms = np.sqrt(np.asarray(X.multiply(X).sum(axis=1))).ravel()
+    norms[norms == 0] = 1
+    return scipy.sparse.diags(1 / norms) @ X
+
+
+def _measure(function, *args, **kwargs):
+    # Returns the wall time (seconds) of the function and the peak memory (MB)
+    # it used, from two separate runs so that measuring the memory does not
+    # slow down the timed run. The first run, which also pays for any imports
+    # and compiling (e.g. numba in UMAP), measures the memory: the largest rise
+    # in the resident set size of this process and its workers, sampled with
+    # psutil, so memory allocated outside Python (e.g. by BLAS) is included.
+    # The memory is None if psutil is not installed.
+    gc.collect()
+    sampler = MemorySampler(0.01)
+    sampler.start()
+    function(*args, **kwargs)
+    peak, source = sampler.stop()
+    peak_mb = peak - sampler.baseline / 2**20 if source == 'psutil' else None
+
+    gc.collect()
+    start = time.perf_counter()
+    function(*args, **kwargs)
+    return time.perf_counter() - start, peak_mb
+
+
+def _tsne_path(X):
+    from sklearn.manifold import TSNE
+
+    TSNE(n_components=2).fit_transform(X)
+
+
+def _reduced_path(X, n_components, method, sample_size):
+    X_reduced = reduce_dimensions(X, n_components)
+    embed_2d(X_reduced, method=method, sample_size=sample_size)
+
+
+def benchmark_reduction(sizes=(10000, 100000, 1000000), n_components=50,
+                        method='umap', sample_size=50000, max_tsne_size=100000):
+    ''' Compares the time and memory of the t-SNE path (t-SNE on the full
+        TF-IDF matrix, as the notebook used to do) with the reduced path
+        (TruncatedSVD, then a 2-D embedding of a sample for plotting) on
+        synthetic TF-IDF matrices.
+
+        Each path is run twice, once to measure its peak memory (the rise in
+        resident set size, which needs psutil) and once to time it. The
+        t-SNE path is skipped for sizes above max_tsne_size, as it can take
+        many hours. Returns a DataFrame with one row per size and path.
+    '''
+    import pandas as pd
+
+    results = []
+    for n in sizes:
+        X = _synthetic_tfidf(n)
+        if n <= max_tsne_size:
+            seconds, peak_mb = _measure(_tsne_path, X)
+            results.append({'n_reviews': n, 'path': 't-SNE on TF-IDF',
+                            'seconds': seconds, 'peak_memory_mb': peak_mb})
+        seconds, peak_mb = _measure(_reduced_path, X, n_components, method, sample_size)
+        results.append({'n_reviews': n,
+                        'path': 'reduced (SVD {}, {} on sample)'.format(n_components, method),
+                        'seconds': seconds, 'peak_memory_mb': peak_mb})
+        print(results[-1])
+    return pd.DataFrame(results)
@@ -0,0 +1,197 @@
+'''
+Vocabulary-level spelling correction.
+
+The ``clean_text`` function in the notebook looks up every token of every
+review in the SymSpell dictionary. In a corpus of reviews the same words are
+used over and over again, so most of those lookups repeat work that has already
+been done. The functions below instead:
+- build the vocabulary (the distinct tokens) of the corpus once;
+- correct each distinct token a single time into a lookup table; and
+- map every review through that lookup table.
+
+The lookup table can be saved to disk, so that re-running the cleaning step on
+the same (or a slightly larger) corpus only needs to correct new words.
+'''
+
+import hashlib
+import json
+import re
+from collections import Counter
+
+from symspellpy import Verbosity
+
+
+def tokenise(text):
+    ''' Converts the text to lowercase, removes punctuation and special
+        characters and uses 'split' to create tokens.
+
+        This is the same as the first steps of ``clean_text`` in the notebook.
+    '''
+    text = str(text).lower()
+    text = re.sub(r'[^\w\s]', '', text.strip())
+    return text.split()
+
+
+def build_vocabulary(texts):
+    ''' Counts how often each distinct token appears across all of the texts.'''
+    vocabulary = Counter()
+    for text in texts:
+        vocabulary.update(tokenise(text))
+    return vocabulary
+
+
+def _fingerprint(vocabulary):
+    # A hash of the words and their counts, whatever order they were counted in.
+    digest = hashlib.blake2b(digest_size=16)
+    for word, count in sorted(vocabulary.items()):
+        digest.update('{}\t{}\n'.format(word, count).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class SpellingTable:
+    ''' A bounded lookup table of spelling corrections.
+
+        Each word is mapped to the first suggestion returned by
+        ``sym_spell.lookup``, or to None if SymSpell has no suggestion (in which
+        case the word is dropped, as in ``clean_text``).
+
+        At most ``max_entries`` words are kept in the table, chosen by how often
+        they have been seen in the vocabularies passed to ``update``. When the
+        table is full, a new word that is more frequent than the least frequent
+        words in the table replaces them, as these are the words least likely
+        to be seen again. ``lookup`` does not know how often a word is used, so
+        it only adds words while the table has room, with a count of 1.
+
+        The table remembers a fingerprint of each vocabulary passed to
+        ``update`` (saved with the table), so that running the same corpus
+        through a loaded table again does not count its words twice.
+    '''
+
+    def __init__(self, sym_spell, max_edit_distance=3, max_entries=500000):
+        self.sym_spell = sym_spell
+        self.max_edit_distance = max_edit_distance
+        self.max_entries = max_entries
+        self.corrections = {}
+        self.counts = Counter()
+        self.applied = set()
+
+    def __len__(self):
+        return len(self.corrections)
+
+    def settings(self):
+        ''' The settings that the corrections depend on. A saved table is only
+            reused if these have not changed.
+        '''
+        return {'max_edit_distance': self.max_edit_distance,
+                'dictionary_size': len(self.sym_spell.words)}
+
+    def _suggest(self, word):
+        suggestions = self.sym_spell.lookup(word, Verbosity.CLOSEST,
+                                            max_edit_distance=self.max_edit_distance)
+        return suggestions[0].term if suggestions else None
+
+    def lookup(self, word):
+        ''' Returns the correction for a single word.'''
+        if word in self.corrections:
+            return self.corrections[word]
+
+        correction = self._suggest(word)
+        if len(self.corrections) < self.max_entries:
+            self.corrections[word] = correction
+            # Seen once, so a full table does not drop it before words that
+            # update has never seen.
+            self.counts[word] += 1
+        return correction
+
+    def update(self, vocabulary):
+        ''' Corrects every word in the vocabulary (a Counter, such as the output
+            of ``build_vocabulary``) that is not already in the table.
+
+            If there is not room for all of them, the table keeps the
+            ``max_entries`` most frequent words, dropping rarer words that are
+            already in it to make room for more frequent new ones.
+
+            A vocabulary that has already been applied to the table (e.g. the
+            same corpus when the notebook is run again) is skipped.
+        '''
+        fingerprint = _fingerprint(vocabulary)
+        if fingerprint in self.applied:
+            return
+        self.applied.add(fingerprint)
+        self.counts.update(vocabulary)
+
+        # Words with the same count keep their order in counts, so words
+        # already in the table are not replaced by new words that are only as
+        # frequent.
+        corrections = {}
+        for word, _ in self.counts.most_common(self.max_entries):
+            if word in self.corrections:
+                corrections[word] = self.corrections[word]
+            else:
+                corrections[word] = self._suggest(word)
+        self.corrections = corrections
+
+        self._trim()
+
+    def correct(self, tokens):
+        ''' Fixes the spelling of a list of tokens.'''
+        corrected = []
+        for word in tokens:
+            correction = self.lookup(word)
+            if correction is not None:
+                corrected.append(correction)
+        return corrected
+
+    def correct_texts(self, texts):
+        ''' Builds the vocabulary of the texts, corrects it, and returns the
+            corrected tokens of each text.
+        '''
+        token_lists = [tokenise(text) for text in texts]
+        vocabulary = Counter()
+        for tokens in token_lists:
+            vocabulary.update(tokens)
+        self.update(vocabulary)
+        return [self.correct(tokens) for tokens in token_lists]
+
+    def _trim(self):
+        # Keep only the most frequent words once the table is over its limit,
+        # and only keep counts for the words in the table.
+        if len(self.corrections) > self.max_entries:
+            keep = sorted(self.corrections, key=lambda word: self.counts[word],
+                          reverse=True)[:self.max_entries]
+            self.corrections = {word: self.corrections[word] for word in keep}
+        self.counts = Counter({word: self.counts[word] for word in self.corrections})
+
+    def save(self, path):
+        ''' Saves the table to a json file.'''
+        self._trim()
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'settings': self.settings(),
+                       'corrections': self.corrections,
+                       'counts': {word: self.counts[word] for word in self.corrections},
+                       'applied': sorted(self.applied)},
+                      f)
+
+    @classmethod
+    def load(cls, path, sym_spell, max_edit_distance=3, max_entries=500000):
+        ''' Loads a table saved with ``save``.
+
+            If the file does not exist, or was created with different settings,
+            an empty table is returned instead.
+        '''
+        table = cls(sym_spell, max_edit_distance, max_entries)
+        try:
+            with open(path, encoding='utf-8') as f:
+                saved = json.load(f)
+        except FileNotFoundError:
+            return table
+
+        if saved['settings'] != table.settings():
+            print('Spelling table settings have changed, starting a new table.')
+            return table
+
+        table.corrections = saved['corrections']
+        table.counts = Counter(saved['counts'])
+        table.applied = set(saved.get('applied', []))
+        table._trim()
+        return table
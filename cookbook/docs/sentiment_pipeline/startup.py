@@ -0,0 +1,104 @@
+'''
+Checking how long the pipeline modules take to import.
+
+A worker process, or a script that only cleans text, pays for everything its
+imports pull in before it does any work. ``import_time`` measures the import of
+a module in a fresh Python process, and records which heavy packages it
+imported. ``check_import_time`` compares these with a budget, so a change that
+makes a module import e.g. scikit-learn at the top is caught.
+
+It can also be run from the command line (it exits with an error if a module is
+over its budget):
+
+    python -m sentiment_pipeline.startup
+'''
+
+import json
+import os
+import subprocess
+import sys
+
+# Packages that take a second or more to import, and which modules should
+# only import when they are used.
+HEAVY_PACKAGES = ('nltk', 'sklearn', 'sentence_transformers', 'torch', 'wordcloud',
+                  'matplotlib')
+
+# The maximum import time (seconds) of each module. Importing a module should
+# not import any of the HEAVY_PACKAGES.
+IMPORT_BUDGET = {
+    'sentiment_pipeline': 0.2,
+    'sentiment_pipeline.spelling': 0.5,
+    'sentiment_pipeline.cleaning': 0.5,
+    'sentiment_pipeline.embeddings': 0.5,
+    'sentiment_pipeline.topics': 1.0,
+    'sentiment_pipeline.reduction': 1.0,
+    'sentiment_pipeline.clustering': 1.0,
+    'sentiment_pipeline.ingest': 1.0,
+    'sentiment_pipeline.profiling': 0.2,
+    'sentiment_pipeline.symspell_index': 0.5,
+    'sentiment_pipeline.startup': 0.2,
+}
+
+_MEASURE = '''
+import json, sys, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps({{'seconds': seconds,
+                  'heavy': [p for p in {heavy!r} if p in sys.modules]}}))
+'''
+
+
+def import_time(module, repeat=3):
+    ''' Imports module in a new Python process repeat times.
+
+        Returns the fastest import time in seconds (the later runs are not
+        slowed down by reading the files from disk for the first time) and the
+        HEAVY_PACKAGES that the import loaded.
+    '''
+    # Run from the folder containing the package, as the notebook does.
+    package_parent = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    code = _MEASURE.format(module=module, heavy=HEAVY_PACKAGES)
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', code], cwd=package_parent,
+                                capture_output=True, text=True, check=True).stdout
+        runs.append(json.loads(output.splitlines()[-1]))
+    return min(run['seconds'] for run in runs), runs[0]['heavy']
+
+
+def check_import_time(budget=IMPORT_BUDGET, repeat=3, raise_error=True):
+    ''' Measures the import time of each module in budget.
+
+        Returns a list with the import time, the heavy packages imported and
+        whether it is within budget for each module. If raise_error is True, a
+        RuntimeError is raised if any module is over its budget or imports a
+        heavy package.
+    '''
+    results = []
+    for module, max_seconds in budget.items():
+        seconds, heavy = import_time(module, repeat)
+        results.append({'module': module, 'seconds': round(seconds, 3),
+                        'budget': max_seconds, 'heavy_packages': heavy,
+                        'ok': seconds <= max_seconds and not heavy})
+    failed = [result for result in results if not result['ok']]
+    if failed and raise_error:
+        raise RuntimeError('Modules over their import budget: ' + ', '.join(
+            '{module} ({seconds}s, budget {budget}s, imports {heavy_packages})'.format(**result)
+            for result in failed))
+    return results
+
+
+def main():
+    results = check_import_time(raise_error=False)
+    for result in results:
+        status = 'ok' if result['ok'] else 'over budget'
+        if result['heavy_packages']:
+            status += ', imports ' + ', '.join(result['heavy_packages'])
+        print('{module:32} {seconds:6.3f}s  (budget {budget}s)  {status}'.format(
+            status=status, **result))
+    sys.exit(0 if all(result['ok'] for result in results) else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+'''
+A SymSpell dictionary saved to disk, ready to use without rebuilding it.
+
+Loading the 82,765 word SymSpell dictionary with ``load_dictionary`` works out
+every way of deleting up to three letters from each word, which takes several
+seconds and hundreds of MB of memory in every process that does it. SymSpell's
+own ``save_pickle`` still has to unpickle all of that into a dictionary. Instead:
+- ``save_index`` writes the deletes as sorted NumPy arrays (the deletes, and
+  for each one the position of its words in a list of the dictionary words);
+- ``load_index`` memory-maps those arrays, so loading takes a fraction of a
+  second, and worker processes that load the same index share the memory
+  rather than each holding their own copy; and
+- the settings the index was built with are saved alongside it, so an index
+  built with different settings is never used by mistake.
+
+The spelling suggestions are exactly the same as for a dictionary loaded with
+``load_dictionary``.
+'''
+
+import json
+import os
+from collections.abc import Mapping
+
+import numpy as np
+
+INDEX_VERSION = 1
+
+
+class MappedDeletes(Mapping):
+    ''' The deletes of a SymSpell dictionary, read from memory-mapped arrays.
+
+        SymSpell only uses ``in`` and ``[]`` on its deletes when looking up a
+        word, so this can be used in place of its dictionary. Each delete is
+        found by a binary search of the sorted deletes.
+    '''
+
+    def __init__(self, keys, offsets, word_ids, words):
+        self.keys = keys
+        self.offsets = offsets
+        self.word_ids = word_ids
+        self.words = words
+
+    def _position(self, key):
+        i = int(np.searchsorted(self.keys, key))
+        if i < len(self.keys) and self.keys[i] == key:
+            return i
+        return None
+
+    def __contains__(self, key):
+        return self._position(key) is not None
+
+    def __getitem__(self, key):
+        i = self._position(key)
+        if i is None:
+            raise KeyError(key)
+        words = self.words
+        return [words[j] for j in self.word_ids[self.offsets[i]:self.offsets[i + 1]]]
+
+    def __iter__(self):
+        return iter(self.keys.tolist())
+
+    def __len__(self):
+        return len(self.keys)
+
+
+def save_index(sym_spell, directory, settings=None):
+    ''' Saves a loaded SymSpell dictionary to a folder.
+
+        settings (e.g. the extra words added to the dictionary) are saved in
+        meta.json and checked by ``load_index``.
+    '''
+    os.makedirs(directory, exist_ok=True)
+    words = list(sym_spell.words)
+    word_position = {word: i for i, word in enumerate(words)}
+
+    keys = sorted(sym_spell.deletes)
+    lengths = np.fromiter((len(sym_spell.deletes[key]) for key in keys), dtype=np.int64,
+                          count=len(keys))
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    # The words of each delete are kept in the same order as in SymSpell, so
+    # that suggestions with the same distance and count come out in the same
+    # order.
+    word_ids = np.fromiter((word_position[word] for key in keys
+                            for word in sym_spell.deletes[key]),
+                           dtype=np.int32, count=int(offsets[-1]))
+
+    np.save(os.path.join(directory, 'keys.npy'), np.array(keys, dtype=str))
+    np.save(os.path.join(directory, 'offsets.npy'), offsets)
+    np.save(os.path.join(directory, 'word_ids.npy'), word_ids)
+    np.save(os.path.join(directory, 'words.npy'), np.array(words, dtype=str))
+    np.save(os.path.join(directory, 'counts.npy'),
+            np.array([sym_spell.words[word] for word in words], dtype=np.int64))
+
+    # meta.json is written last, so a folder without it is never loaded.
+    with open(os.path.join(directory, 'meta.json'), 'w') as f:
+        json.dump({'version': INDEX_VERSION,
+                   'max_dictionary_edit_distance': sym_spell._max_dictionary_edit_distance,
+                   'prefix_length': sym_spell._prefix_length,
+                   'count_threshold': sym_spell._count_threshold,
+                   'max_length': sym_spell._max_length,
+                   'settings': settings or {}}, f)
+
+
+def load_index(directory, max_edit_distance=3, prefix_length=7, settings=None):
+    ''' Loads a SymSpell dictionary saved with ``save_index``.
+
+        Returns None if there is no index in the folder, or it was built with
+        different settings.
+    '''
+    from symspellpy import SymSpell
+
+    try:
+        with open(os.path.join(directory, 'meta.json')) as f:
+            meta = json.load(f)
+    except FileNotFoundError:
+        return None
+    if (meta['version'], meta['max_dictionary_edit_distance'], meta['prefix_length'],
+            meta['settings']) != (INDEX_VERSION, max_edit_distance, prefix_length,
+                                  settings or {}):
+        return None
+
+    def array(name):
+        return np.load(os.path.join(directory, name), mmap_mode='r')
+
+    words = array('words.npy').tolist()
+    sym_spell = SymSpell(max_dictionary_edit_distance=max_edit_distance,
+                         prefix_length=prefix_length,
+                         count_threshold=meta['count_threshold'])
+    sym_spell._words = dict(zip(words, array('counts.npy').tolist()))
+    sym_spell._max_length = meta['max_length']
+    sym_spell._deletes = MappedDeletes(array('keys.npy'), array('offsets.npy'),
+                                       array('word_ids.npy'), words)
+    return sym_spell
@@ -0,0 +1,89 @@
+'''
+Summarising the terms used in each cluster.
+
+``get_wordcloud`` in the notebook filters the reviews for each cluster, removes
+the blacklisted words from each review with ``str.replace``, joins the reviews
+into one long string and lets ``WordCloud`` split it into words again. This is
+repeated for every cluster of every model.
+
+The document-term matrix built for the TF-IDF model already holds the terms of
+every review, so ``cluster_term_frequencies`` adds up the rows of that matrix for
+each cluster in one sparse matrix multiplication. Blacklisted terms are dropped
+by zeroing their columns. The word clouds and tables of top terms are then made
+directly from these frequencies.
+'''
+
+import numpy as np
+import pandas as pd
+import scipy.sparse
+
+
+def cluster_term_frequencies(doc_term, labels, terms, blacklist=(), n_clusters=None):
+    ''' Adds up the rows of the document-term matrix for each cluster.
+
+        doc_term can be the output of a CountVectorizer (term counts) or a
+        TfidfVectorizer (TF-IDF weights), with terms the matching
+        ``get_feature_names_out()``. Terms in the blacklist are given a
+        frequency of zero.
+
+        Returns a sparse matrix with one row per cluster and one column per term.
+    '''
+    labels = np.asarray(labels)
+    if n_clusters is None:
+        n_clusters = labels.max() + 1
+
+    # A (cluster x review) matrix with a one where the review is in the
+    # cluster, so multiplying it by the (review x term) matrix sums the
+    # reviews in each cluster.
+    membership = scipy.sparse.csr_matrix(
+        (np.ones(len(labels)), (labels, np.arange(len(labels)))),
+        shape=(n_clusters, len(labels)))
+    frequencies = (membership @ scipy.sparse.csr_matrix(doc_term)).tocsc()
+
+    # Drop the blacklisted terms by multiplying their columns by zero.
+    keep = ~np.isin(np.asarray(terms), list(blacklist))
+    frequencies = frequencies @ scipy.sparse.diags(keep.astype(frequencies.dtype))
+    frequencies = frequencies.tocsr()
+    frequencies.eliminate_zeros()
+    return frequencies
+
+
+def top_terms(frequencies, terms, n=20):
+    ''' Returns a table of the n most frequent terms in each cluster.'''
+    terms = np.asarray(terms)
+    table = {}
+    for cluster in range(frequencies.shape[0]):
+        row = frequencies.getrow(cluster)
+        order = np.argsort(row.data)[::-1][:n]
+        top = terms[row.indices[order]].tolist()
+        table['cluster {}'.format(cluster + 1)] = top + [''] * (n - len(top))
+    return pd.DataFrame(table)
+
+
+def term_dictionary(frequencies, terms, cluster, max_words=200):
+    ''' Returns {term: frequency} for the max_words most frequent terms in a
+        cluster, as used by ``WordCloud.generate_from_frequencies``.
+    '''
+    terms = np.asarray(terms)
+    row = frequencies.getrow(cluster)
+    order = np.argsort(row.data)[::-1][:max_words]
+    return {str(terms[i]): float(f) for i, f in zip(row.indices[order], row.data[order])}
+
+
+def plot_wordcloud(frequencies, terms, cluster, max_words=200):
+    ''' Plots the word cloud of a cluster, in the same style as
+        ``get_wordcloud`` in the notebook.
+    '''
+    import matplotlib.pyplot as plt
+    from wordcloud import WordCloud
+
+    print('Getting wordcloud for topic {} ...'.format(cluster + 1))
+    wordcloud = WordCloud(width=800, height=560, background_color='white',
+                          collocations=False, min_font_size=10,
+                          max_words=max_words).generate_from_frequencies(
+        term_dictionary(frequencies, terms, cluster, max_words))
+
+    plt.figure(figsize=(8, 5.6), facecolor=None)
+    plt.imshow(wordcloud)
+    plt.axis('off')
+    plt.tight_layout(pad=5)
@@ -0,0 +1,12 @@
+"""
+Tests of the helper modules used by the notebooks.
+
+Run from the cookbook/docs folder with ``python -m pytest tests``. The tests of
+a module are skipped if a package it needs is not installed.
+"""
+
+import os
+import sys
+
+# The notebooks import the helper modules from the cookbook/docs folder.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,169 @@
+"""
+Tests of llm_extraction against a local stub server standing in for Ollama.
+
+The stub answers ``/v1/chat/completions`` requests like Ollama's OpenAI
+compatible API, with the answers given by each test.
+"""
+
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+openai = pytest.importorskip('openai')
+
+import llm_extraction  # noqa: E402
+from llm_extraction import ERROR_RESULT, ResultLog, review_hash, run_extraction  # noqa: E402
+
+MODEL = 'stub-model'
+
+
+def answer(review, sentiment='Positive'):
+    return json.dumps({'sentiment': sentiment, 'feedback_category': 'Claims Process',
+                       'specific_issue': review})
+
+
+class StubServer:
+    """
+    A chat completions server on a free local port.
+
+    reply(review, attempt) returns the content of the answer to the attempt'th
+    request (from 0) for a review. The server records the number of requests
+    for each review, and the most requests it worked on at the same time.
+    """
+
+    def __init__(self, reply, delay=0.0):
+        self.reply = reply
+        self.delay = delay
+        self.requests = {}
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                prompt = body['messages'][0]['content']
+                review = prompt.split('Review:\n"', 1)[1].rsplit('"\n\nJSON Output:', 1)[0]
+                with stub.lock:
+                    attempt = stub.requests.get(review, 0)
+                    stub.requests[review] = attempt + 1
+                    stub.in_flight += 1
+                    stub.max_in_flight = max(stub.max_in_flight, stub.in_flight)
+                time.sleep(stub.delay)
+                content = stub.reply(review, attempt)
+                with stub.lock:
+                    stub.in_flight -= 1
+                data = json.dumps({
+                    'id': 'chatcmpl-stub', 'object': 'chat.completion', 'created': 0,
+                    'model': body['model'],
+                    'choices': [{'index': 0, 'finish_reason': 'stop',
+                                 'message': {'role': 'assistant', 'content': content}}],
+                }).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def client(self):
+        return openai.AsyncOpenAI(
+            base_url='http://127.0.0.1:{}/v1'.format(self.server.server_address[1]),
+            api_key='ollama', max_retries=0)
+
+
+def extract(reviews, stub, log_path, **kwargs):
+    kwargs.setdefault('backoff', 0.0)
+    return asyncio.run(run_extraction(reviews, stub.client(), MODEL, str(log_path),
+                                      **kwargs))
+
+
+def test_results_are_in_order_and_logged(tmp_path):
+    reviews = ['review {}'.format(i) for i in range(20)] + ['review 3']
+    log_path = tmp_path / 'results.jsonl'
+    with StubServer(lambda review, attempt: answer(review), delay=0.02) as stub:
+        results, stats = extract(reviews, stub, log_path, concurrency=4)
+
+    assert [result['specific_issue'] for result in results] == reviews
+    # The repeated review is only sent once.
+    assert sum(stub.requests.values()) == 20
+    assert stats['reviews_sent'] == 20 and stats['failed'] == 0
+    assert 1 < stub.max_in_flight <= 4
+    log = ResultLog(str(log_path))
+    assert len(log.results) == 20
+    assert log.results[review_hash('review 7', MODEL)]['specific_issue'] == 'review 7'
+
+
+def test_restart_only_sends_new_reviews(tmp_path):
+    log_path = tmp_path / 'results.jsonl'
+    with StubServer(lambda review, attempt: answer(review)) as stub:
+        extract(['a', 'b'], stub, log_path)
+        results, stats = extract(['a', 'b', 'c'], stub, log_path)
+
+    assert stub.requests == {'a': 1, 'b': 1, 'c': 1}
+    assert stats['reviews_from_log'] == 2 and stats['reviews_sent'] == 1
+    assert [result['specific_issue'] for result in results] == ['a', 'b', 'c']
+
+
+def test_changing_the_prompt_sends_reviews_again(tmp_path, monkeypatch):
+    log_path = tmp_path / 'results.jsonl'
+    build_prompt = llm_extraction.build_prompt
+    with StubServer(lambda review, attempt: answer(review)) as stub:
+        extract(['a'], stub, log_path)
+        monkeypatch.setattr(llm_extraction, 'build_prompt',
+                            lambda review_text: 'Be brief.\n' + build_prompt(review_text))
+        extract(['a'], stub, log_path)
+
+    assert stub.requests == {'a': 2}
+
+
+def test_invalid_json_is_retried(tmp_path):
+    def reply(review, attempt):
+        return 'Sure! Here is the JSON:' if attempt < 2 else answer(review)
+
+    with StubServer(reply) as stub:
+        results, stats = extract(['a'], stub, tmp_path / 'results.jsonl', max_retries=3)
+
+    assert results[0]['specific_issue'] == 'a'
+    assert stub.requests == {'a': 3}
+    assert stats['retries'] == 2 and stats['failed'] == 0
+
+
+def test_missing_fields_are_reported_and_not_logged(tmp_path, capsys):
+    log_path = tmp_path / 'results.jsonl'
+    with StubServer(lambda review, attempt: json.dumps({'sentiment': 'Neutral'})) as stub:
+        results, stats = extract(['a'], stub, log_path, max_retries=1)
+
+    assert results == [ERROR_RESULT]
+    assert stub.requests == {'a': 2}
+    assert stats['failed'] == 1
+    output = capsys.readouterr().out
+    assert "missing the fields ['feedback_category', 'specific_issue']" in output
+    assert 'invalid JSON' not in output
+    assert not log_path.exists()
+
+
+def test_invalid_json_is_reported(tmp_path, capsys):
+    with StubServer(lambda review, attempt: '{"sentiment": ') as stub:
+        results, _ = extract(['a'], stub, tmp_path / 'results.jsonl', max_retries=0)
+
+    assert results == [ERROR_RESULT]
+    assert 'invalid JSON' in capsys.readouterr().out
@@ -0,0 +1,48 @@
+"""
+Tests that the sentiment_pipeline modules import quickly, without importing
+the heavy packages.
+
+Import times depend on the machine and how busy it is, so they are only
+checked against the budgets if IMPORT_BUDGET_SCALE is set, e.g. to 1 on a
+quiet machine or 5 on a shared CI runner (the budgets are multiplied by it).
+"""
+
+import os
+import pkgutil
+
+import pytest
+
+pytest.importorskip('numpy')
+
+import sentiment_pipeline  # noqa: E402
+from sentiment_pipeline.startup import IMPORT_BUDGET, check_import_time  # noqa: E402
+
+
+def test_every_module_has_a_budget():
+    modules = {'sentiment_pipeline.' + module.name
+               for module in pkgutil.iter_modules([os.path.dirname(sentiment_pipeline.__file__)])}
+    assert modules | {'sentiment_pipeline'} == set(IMPORT_BUDGET)
+
+
+def test_modules_do_not_import_heavy_packages():
+    results = check_import_time(raise_error=False)
+    assert [result['module'] for result in results] == list(IMPORT_BUDGET)
+    for result in results:
+        print('{module}: {seconds}s (budget {budget}s)'.format(**result))
+    assert {result['module']: result['heavy_packages'] for result in results} == {
+        module: [] for module in IMPORT_BUDGET}
+
+
+@pytest.mark.skipif('IMPORT_BUDGET_SCALE' not in os.environ,
+                    reason='set IMPORT_BUDGET_SCALE to check the import times')
+def test_import_times_are_within_budget():
+    scale = float(os.environ['IMPORT_BUDGET_SCALE'])
+    check_import_time({module: seconds * scale for module, seconds in IMPORT_BUDGET.items()})
+
+
+def test_importing_a_heavy_package_is_over_budget():
+    pytest.importorskip('sklearn')
+    with pytest.raises(RuntimeError, match='imports'):
+        check_import_time({'sklearn': 60}, repeat=1)
+    result, = check_import_time({'sklearn': 60}, repeat=1, raise_error=False)
+    assert result['heavy_packages'] == ['sklearn'] and not result['ok']
@@ -0,0 +1,151 @@
+"""
+Tests of wb_indicators against a local stub server standing in for the World
+Bank, so that they run offline.
+"""
+
+import io
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+pd = pytest.importorskip('pandas')
+requests = pytest.importorskip('requests')
+pytest.importorskip('openpyxl')
+pytest.importorskip('pyarrow')
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__)))), '_static', 'lecture_specific', 'pandas'))
+
+from wb_indicators import fetch_indicator, load_indicators, make_session  # noqa: E402
+
+
+def excel_download(indicator, value):
+    """An Excel file laid out like the World Bank download."""
+    wide = pd.DataFrame({'Country Name': ['Australia', 'United States'],
+                         'Country Code': ['AUS', 'USA'],
+                         'Indicator Name': ['Central government debt'] * 2,
+                         'Indicator Code': [indicator] * 2,
+                         '2000': [value, value + 1], '2001': [value + 2, None]})
+    content = io.BytesIO()
+    with pd.ExcelWriter(content) as writer:
+        pd.DataFrame([['Data Source', 'World Development Indicators']]).to_excel(
+            writer, sheet_name='Data', index=False, header=False)
+        wide.to_excel(writer, sheet_name='Data', index=False, startrow=3)
+    return content.getvalue()
+
+
+class StubServer:
+    """
+    Serves each indicator at /indicator/<code>, with an ETag for the version
+    of its data, answering 304 Not Modified if the client already has it.
+    """
+
+    def __init__(self):
+        self.version = 1
+        self.requests = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                indicator = self.path.split('?')[0].rsplit('/', 1)[1]
+                etag = '"v{}"'.format(stub.version)
+                stub.requests.append((indicator, self.headers.get('If-None-Match')))
+                if self.headers.get('If-None-Match') == etag:
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.end_headers()
+                    return
+                content = excel_download(indicator, 10.0 * stub.version)
+                self.send_response(200)
+                self.send_header('ETag', etag)
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url_template = 'http://127.0.0.1:{}/indicator/{{}}?downloadformat=excel'.format(
+            self.server.server_address[1])
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stub():
+    server = StubServer()
+    yield server
+    server.close()
+
+
+def fetch(stub, cache_dir, **kwargs):
+    return fetch_indicator('GC.DOD.TOTL.GD.ZS', cache_dir=cache_dir,
+                           url_template=stub.url_template, **kwargs)
+
+
+def test_download(stub, tmp_path):
+    data, source = fetch(stub, tmp_path)
+
+    assert source == 'downloaded'
+    assert list(data.columns) == ['indicator', 'country_code', 'country_name', 'year', 'value']
+    # The missing value for the USA in 2001 is dropped.
+    assert sorted(zip(data['country_code'], data['year'], data['value'])) == [
+        ('AUS', 2000, 10.0), ('AUS', 2001, 12.0), ('USA', 2000, 11.0)]
+    assert (tmp_path / 'GC.DOD.TOTL.GD.ZS.parquet').exists()
+    assert (tmp_path / 'GC.DOD.TOTL.GD.ZS.json').exists()
+
+
+def test_cache_is_used_within_max_age(stub, tmp_path):
+    downloaded, _ = fetch(stub, tmp_path)
+    data, source = fetch(stub, tmp_path)
+
+    assert source == 'cache'
+    assert len(stub.requests) == 1
+    pd.testing.assert_frame_equal(data, downloaded)
+
+
+def test_revalidation(stub, tmp_path):
+    downloaded, _ = fetch(stub, tmp_path)
+    data, source = fetch(stub, tmp_path, max_age=0)
+
+    assert source == 'not modified'
+    assert stub.requests[-1] == ('GC.DOD.TOTL.GD.ZS', '"v1"')
+    pd.testing.assert_frame_equal(data, downloaded)
+
+    # New data on the server is downloaded.
+    stub.version = 2
+    data, source = fetch(stub, tmp_path, max_age=0)
+    assert source == 'downloaded'
+    assert data['value'].max() == 22.0
+
+
+def test_stale_cache_is_used_if_the_server_is_down(stub, tmp_path):
+    downloaded, _ = fetch(stub, tmp_path)
+    stub.close()
+    session = make_session(retries=0)
+
+    with pytest.warns(UserWarning, match='using the cached copy'):
+        data, source = fetch(stub, tmp_path, max_age=0, session=session)
+    assert source == 'stale cache'
+    pd.testing.assert_frame_equal(data, downloaded)
+
+    # With nothing cached, the error is raised.
+    with pytest.raises(requests.ConnectionError):
+        fetch(stub, tmp_path / 'empty', max_age=0, session=session)
+
+
+def test_load_indicators_from_a_generator(stub, tmp_path, capsys):
+    indicators = ['GC.DOD.TOTL.GD.ZS', 'NY.GDP.MKTP.CD']
+    data = load_indicators((indicator for indicator in indicators), cache_dir=tmp_path,
+                           url_template=stub.url_template)
+
+    assert set(data['indicator']) == set(indicators)
+    assert capsys.readouterr().out.splitlines() == [
+        'GC.DOD.TOTL.GD.ZS: downloaded', 'NY.GDP.MKTP.CD: downloaded']
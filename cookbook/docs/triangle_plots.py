@@ -0,0 +1,161 @@
+"""
+Heatmaps of large claims triangles, and many triangles at once.
+
+Used by the *Py: Machine Learning Triangles* notebook (MLRWP_Py_triangles_example.ipynb).
+
+``plot_triangle`` in the notebook draws a seaborn heatmap of a pivoted
+DataFrame, which draws every cell as a separate shape. That is fine for a
+40x40 quarterly triangle, but slow for monthly or weekly triangles
+(400x400 or more), and when hundreds of triangles are plotted. Here:
+- ``plot_triangle_array`` draws a NumPy array (or DataFrame) as one image with
+  ``imshow``, with the future cells hidden by a masked array;
+- the triangle masks are calculated once for each size and reused;
+- the values are only written in the cells for triangles up to
+  ``max_annotate`` periods, as they cannot be read on larger ones; and
+- ``render_triangles`` draws many triangles on a pool of processes and saves
+  them to one PDF file, one triangle per page.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.colors import LogNorm
+from matplotlib.figure import Figure
+
+
+@lru_cache(maxsize=32)
+def triangle_mask(n_origin, n_development=None):
+    """
+    A boolean array that is True for the future cells of a triangle, i.e.
+    where origin period + development period - 1 is after the last period.
+
+    This is the same mask as in ``plot_triangle`` in the notebook. The mask for
+    each size is only calculated once, and is read-only as it is shared.
+    """
+    if n_development is None:
+        n_development = n_origin
+    origin = np.arange(n_origin)[:, None]
+    development = np.arange(n_development)[None, :]
+    mask = origin + development > n_origin - 1
+    mask.flags.writeable = False
+    return mask
+
+
+def _tick_positions(n, max_ticks=20):
+    # Label every period on small triangles, but only every few periods on
+    # large ones, so the labels do not overlap.
+    step = max(1, int(np.ceil(n / max_ticks)))
+    return np.arange(0, n, step)
+
+
+def plot_triangle_array(data, mask_bottom=True, title="Claims Development", cmap="viridis_r",
+                        log_scale=True, annotate=False, max_annotate=30, fmt="{:.0f}",
+                        fig=None, ax=None):
+    """ Plots a claims triangle heatmap from an array
+    data:
+        2D NumPy array of (origin period, development period), or a DataFrame
+        as used by ``plot_triangle`` (e.g. ``dat.pivot(...)``)
+    mask_bottom:
+        Hide bottom half of triangle
+    cmap:
+        Matplotlib colour map (or its name)
+    log_scale:
+        Use a log scale for the colours, as ``plot_triangle`` does
+    annotate, max_annotate, fmt:
+        Write the values in the cells, but only if the triangle has no more
+        than max_annotate origin periods
+    fig, ax: optional fig and ax
+    """
+    row_labels = getattr(data, "index", None)
+    column_labels = getattr(data, "columns", None)
+    values = np.asarray(data, dtype=float)
+    n_origin, n_development = values.shape
+
+    hidden = ~np.isfinite(values)
+    if log_scale:
+        hidden |= values <= 0  # Cannot be shown on a log scale
+    if mask_bottom:
+        hidden |= triangle_mask(n_origin, n_development)
+    masked = np.ma.masked_array(values, mask=hidden)
+
+    if ax is None:
+        if fig is None:
+            import matplotlib.pyplot as plt
+            fig, ax = plt.subplots(figsize=(6, 5))
+        else:
+            ax = fig.add_subplot()
+
+    image = ax.imshow(masked, cmap=cmap, norm=LogNorm() if log_scale else None,
+                      interpolation="nearest", aspect="equal")
+    ax.figure.colorbar(image, ax=ax, shrink=0.5)
+    ax.set_title(title)
+
+    rows, columns = _tick_positions(n_origin), _tick_positions(n_development)
+    ax.set_yticks(rows)
+    ax.set_xticks(columns)
+    ax.set_yticklabels(row_labels[rows] if row_labels is not None else rows + 1)
+    ax.set_xticklabels(column_labels[columns] if column_labels is not None else columns + 1,
+                       rotation=90)
+    ax.tick_params(length=0)
+    for spine in ax.spines.values():
+        spine.set_visible(False)
+
+    if annotate and n_origin <= max_annotate:
+        for i, j in zip(*np.nonzero(~hidden)):
+            ax.text(j, i, fmt.format(values[i, j]), ha="center", va="center", fontsize=6)
+
+    return fig, ax
+
+
+def _render_page(args):
+    # Draws one triangle on its own figure (without pyplot, so nothing is
+    # shared between pages) and returns the page as an RGBA image.
+    data, title, figsize, dpi, options = args
+    fig = Figure(figsize=figsize, dpi=dpi)
+    canvas = FigureCanvasAgg(fig)
+    plot_triangle_array(data, title=title, fig=fig, ax=fig.add_subplot(), **options)
+    canvas.draw()
+    return np.asarray(canvas.buffer_rgba()).copy()
+
+
+def render_triangles(triangles, path, figsize=(6, 5), dpi=150, n_jobs=None, chunksize=4,
+                     **options):
+    """
+    Draws many triangles and saves them to one PDF file, one triangle per page.
+
+    triangles is a dictionary of {title: triangle}, where each triangle is an
+    array or DataFrame as for ``plot_triangle_array``; any other options (e.g.
+    mask_bottom=False or cmap) are passed on to ``plot_triangle_array``.
+
+    The pages are drawn on n_jobs processes (all cores by default; n_jobs=1
+    draws them in the current process) as images at the given dpi, and then
+    written to the PDF in order.
+    """
+    from matplotlib.backends.backend_pdf import PdfPages
+
+    tasks = [(data, title, figsize, dpi, options) for title, data in triangles.items()]
+    if n_jobs is None:
+        n_jobs = os.cpu_count() or 1
+
+    with PdfPages(path) as pdf:
+        if n_jobs == 1 or len(tasks) <= 1:
+            pages = map(_render_page, tasks)
+            _write_pages(pdf, pages, dpi)
+        else:
+            with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+                _write_pages(pdf, executor.map(_render_page, tasks, chunksize=chunksize), dpi)
+    return path
+
+
+def _write_pages(pdf, pages, dpi):
+    # The pages are written in order, each as soon as it (and the pages
+    # before it) are finished.
+    for image in pages:
+        height, width = image.shape[:2]
+        fig = Figure(figsize=(width / dpi, height / dpi), dpi=dpi)
+        FigureCanvasAgg(fig)
+        fig.figimage(image)
+        pdf.savefig(fig, dpi=dpi)
@@ -0,0 +1,270 @@
+"""
+Building claims triangles in DuckDB.
+
+Used by the *SQL: Queries to Create Triangles* notebook (SQL Query for Triangles.ipynb).
+
+The notebook reads the transactions into pandas, works out the dates row by row
+with ``relativedelta``, and the SQL query then turns the dates back from strings
+with ``STRPTIME`` before taking differences in months. The functions below are
+for when the transaction tables are too large for that to be practical:
+- ``read_transactions`` points DuckDB straight at Parquet or CSV files, so the
+  data never needs to be loaded into pandas;
+- the periods are calculated with integer arithmetic on the year and month of
+  each date, i.e. ``(year * 12 + month) - (start year * 12 + start month) + 1``,
+  with no conversion between dates and strings;
+- ``build_triangle`` saves the summarised triangle as a table, and
+  ``update_triangle`` adds a new month (or any new file) of transactions to it
+  without going back over the transactions already included;
+- ``fill_triangle`` adds the zero cells to the (small) triangle table rather than
+  to the transactions; and
+- with ``segment_columns`` (e.g. line of business, state or product), one table
+  holds the triangles of every segment, and ``triangle_arrays`` returns the
+  incremental and cumulative triangles of all segments from a single query, as
+  NumPy arrays of shape (segment, occurrence period, development period).
+
+Using a DuckDB database file, e.g. ``duckdb.connect('triangles.duckdb')``, keeps
+the triangle between runs, so each month only the new transactions are read.
+"""
+
+import datetime
+
+import numpy as np
+import pandas as pd
+
+TRIANGLE_COLUMNS = ('occurrence_period', 'development_period', 'payment_period', 'payments')
+
+
+def dates_from_times(times, start_date='2000-01-01'):
+    """
+    Converts the time units in the example dataset to dates without a loop.
+
+    This gives the same dates as the ``relativedelta`` calculation in the
+    notebook: the whole number of months after start_date, plus the fraction of
+    a month as days (with 28 days to a month).
+    """
+    times = np.asarray(times, dtype=float)
+    start = np.datetime64(start_date, 'M')
+    months = start + np.floor(times).astype(int)
+    days = (times % 1 * 28).astype(int)
+    return months.astype('datetime64[D]') + days
+
+
+def read_transactions(con, path, view='transactions_view'):
+    """
+    Creates a view of the transactions in a Parquet or CSV file (or files, with
+    a wildcard such as 'transactions/*.parquet'), without loading them into
+    memory.
+    """
+    if str(path).lower().endswith('.parquet'):
+        reader = f"read_parquet('{path}')"
+    else:
+        reader = f"read_csv_auto('{path}')"
+    con.execute(f"CREATE OR REPLACE VIEW {view} AS SELECT * FROM {reader}")
+    return view
+
+
+def _month_number(column, start_date):
+    # The period number of a date, where start_date is in period 1.
+    start = pd.Timestamp(start_date)
+    return (f"(YEAR(CAST({column} AS DATE)) * 12 + MONTH(CAST({column} AS DATE)) "
+            f"- {start.year * 12 + start.month} + 1)")
+
+
+def _summarise_sql(source, start_date, segment_columns=()):
+    occurrence = _month_number('occurrence_date', start_date)
+    payment = _month_number('payment_date', start_date)
+    segments = ''.join(f'{column}, ' for column in segment_columns)
+    return f"""
+        SELECT
+            {segments}
+            {occurrence} AS occurrence_period,
+            {payment} - {occurrence} + 1 AS development_period,
+            {payment} AS payment_period,
+            SUM(payment_size) AS payments
+        FROM {source}
+        GROUP BY ALL
+    """
+
+
+def _segment_columns(con, table):
+    # Any columns of the triangle table other than the periods and payments
+    # are segment columns (e.g. line of business or state).
+    columns = [row[0] for row in con.execute(f"DESCRIBE {table}").fetchall()]
+    return [column for column in columns if column not in TRIANGLE_COLUMNS]
+
+
+def build_triangle(con, source, start_date='2000-01-01', table='triangle',
+                   segment_columns=(), source_path=None):
+    """
+    Summarises the transactions in source (a table or view with occurrence_date,
+    payment_date and payment_size columns) into a triangle table.
+
+    If segment_columns are given (e.g. ['line_of_business', 'state']), there is
+    a separate triangle for each combination of their values, all stored in
+    the same table.
+
+    Any existing triangle table with the same name is replaced.
+
+    source_path is the file (or files) that source was read from with
+    ``read_transactions``. It is recorded as loaded (the name of source is
+    recorded if it is not given), so that ``update_triangle`` skips it if
+    the same file is added again.
+    """
+    segment_columns = list(segment_columns)
+    segment_types = []
+    if segment_columns:
+        described = con.execute(
+            f"DESCRIBE SELECT {', '.join(segment_columns)} FROM {source}").fetchall()
+        segment_types = [f'{name} {column_type}, ' for name, column_type, *_ in described]
+    key = ', '.join(segment_columns + ['occurrence_period', 'development_period'])
+
+    con.execute(f"""
+        CREATE OR REPLACE TABLE {table} (
+            {''.join(segment_types)}
+            occurrence_period INTEGER,
+            development_period INTEGER,
+            payment_period INTEGER,
+            payments DOUBLE,
+            PRIMARY KEY ({key})
+        )
+    """)
+    con.execute(f"CREATE OR REPLACE TABLE {table}_loads (source VARCHAR, loaded_at TIMESTAMP)")
+    con.execute(f"INSERT INTO {table} {_summarise_sql(source, start_date, segment_columns)}")
+    con.execute(f"INSERT INTO {table}_loads VALUES (?, ?)",
+                [str(source if source_path is None else source_path), datetime.datetime.now()])
+    return con.execute(f"SELECT * FROM {table} ORDER BY ALL").fetchdf()
+
+
+def update_triangle(con, path, start_date='2000-01-01', table='triangle'):
+    """
+    Adds the transactions in a new Parquet or CSV file to an existing triangle.
+
+    Only the new file is read. Its payments are summarised to the triangle
+    cells and added to the cells already in the table. A file that has
+    already been added is skipped, so running the update twice does not double
+    count the payments.
+    """
+    already_loaded = con.execute(
+        f"SELECT COUNT(*) FROM {table}_loads WHERE source = ?", [str(path)]).fetchone()[0]
+    if already_loaded:
+        print(f"'{path}' has already been added to {table}, skipping it.")
+        return
+
+    segment_columns = _segment_columns(con, table)
+    key = ', '.join(segment_columns + ['occurrence_period', 'development_period'])
+    new_view = read_transactions(con, path, view=f'{table}_new_transactions')
+    con.execute(f"""
+        INSERT INTO {table} {_summarise_sql(new_view, start_date, segment_columns)}
+        ON CONFLICT ({key})
+        DO UPDATE SET payments = payments + EXCLUDED.payments
+    """)
+    con.execute(f"INSERT INTO {table}_loads VALUES (?, ?)",
+                [str(path), datetime.datetime.now()])
+
+
+def _fill_sql(table, n_periods, segment_columns):
+    # Every combination of segment, occurrence period and development period
+    # up to n_periods, with the payments from the triangle table (or zero).
+    segments = ''.join(f'segments.{column}, ' for column in segment_columns)
+    if segment_columns:
+        segment_list = f"(SELECT DISTINCT {', '.join(segment_columns)} FROM {table}) AS segments,"
+    else:
+        segment_list = ''
+    return f"""
+        WITH full_tri AS (
+            SELECT
+                {segments}
+                o.range AS occurrence_period,
+                d.range AS development_period,
+                o.range + d.range - 1 AS payment_period
+            FROM
+                {segment_list}
+                range(1, {n_periods} + 1) AS o,
+                range(1, {n_periods} + 1) AS d
+            WHERE
+                o.range + d.range - 1 <= {n_periods}
+        )
+        SELECT
+            full_tri.*,
+            COALESCE({table}.payments, 0) AS payments
+        FROM
+            full_tri
+        LEFT JOIN
+            {table}
+        USING ({', '.join(list(segment_columns) + ['occurrence_period', 'development_period'])})
+    """
+
+
+def fill_triangle(con, n_periods, table='triangle', view='triangle_fill'):
+    """
+    Creates a view of the triangle with a row for every occurrence and
+    development period up to n_periods (and every segment, if the triangle has
+    segments), with zero payments where the triangle has no transactions.
+
+    The view is calculated from the triangle table when it is queried, so it
+    does not need to be rebuilt when the triangle is updated.
+    """
+    segment_columns = _segment_columns(con, table)
+    order = ', '.join(segment_columns + ['occurrence_period', 'development_period'])
+    con.execute(f"""
+        CREATE OR REPLACE VIEW {view} AS
+        {_fill_sql(table, n_periods, segment_columns)}
+        ORDER BY
+            {order}
+    """)
+    return con.execute(f"SELECT * FROM {view}").fetchdf()
+
+
+def triangle_arrays(con, n_periods, table='triangle', future_value=np.nan):
+    """
+    Returns the incremental and cumulative triangles of every segment at once.
+
+    The zero cells are filled in and the cumulative payments calculated by one
+    DuckDB query, using a window function (a running SUM over the development
+    periods of each segment and occurrence period), rather than a loop over
+    the segments in pandas.
+
+    Returns:
+    - a DataFrame of the segments, where row i describes segment i of the arrays;
+    - the incremental payments, an array of shape (segment, occurrence period,
+      development period); and
+    - the cumulative payments, an array of the same shape.
+    Cells after the last payment period are set to future_value.
+    """
+    segment_columns = _segment_columns(con, table)
+    if segment_columns:
+        segment_id = f"DENSE_RANK() OVER (ORDER BY {', '.join(segment_columns)}) - 1"
+        partition = ', '.join(segment_columns) + ', occurrence_period'
+    else:
+        segment_id = '0'
+        partition = 'occurrence_period'
+
+    cells = con.execute(f"""
+        SELECT
+            {segment_id} AS segment_id,
+            occurrence_period,
+            development_period,
+            payments,
+            SUM(payments) OVER (
+                PARTITION BY {partition}
+                ORDER BY development_period
+            ) AS payments_cumulative
+        FROM ({_fill_sql(table, n_periods, segment_columns)})
+    """).fetchnumpy()
+
+    if segment_columns:
+        segments = con.execute(f"""
+            SELECT DISTINCT {', '.join(segment_columns)} FROM {table} ORDER BY ALL
+        """).fetchdf()
+    else:
+        segments = pd.DataFrame(index=[0])
+
+    shape = (len(segments), n_periods, n_periods)
+    incremental = np.full(shape, future_value, dtype=float)
+    cumulative = np.full(shape, future_value, dtype=float)
+    index = (np.asarray(cells['segment_id'], dtype=int),
+             np.asarray(cells['occurrence_period'], dtype=int) - 1,
+             np.asarray(cells['development_period'], dtype=int) - 1)
+    incremental[index] = cells['payments']
+    cumulative[index] = cells['payments_cumulative']
+    return segments, incremental, cumulative